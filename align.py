@@ -0,0 +1,142 @@
+from bisect import bisect_left
+
+import numpy as np
+
+# ========== Row Hashing ==========
+_WEIGHTS = {}
+
+def _weights(words):
+    # Fixed random odd multipliers, so hashes are comparable across images and runs
+    if words not in _WEIGHTS:
+        rng = np.random.default_rng(0x5EED)
+        _WEIGHTS[words] = rng.integers(0, 2**64 - 1, size=words, dtype=np.uint64, endpoint=True) | np.uint64(1)
+    return _WEIGHTS[words]
+
+def row_hashes(array, chunk_rows=1024):
+    # One 64-bit multiply-sum hash per pixel row, computed in chunks to bound memory
+    height = array.shape[0]
+    flat = array.reshape(height, -1)
+    pad = (-flat.shape[1]) % 8
+    weights = _weights((flat.shape[1] + pad) // 8)
+    hashes = np.empty(height, dtype=np.uint64)
+    for y0 in range(0, height, chunk_rows):
+        block = flat[y0:y0 + chunk_rows]
+        if pad:
+            block = np.pad(block, ((0, 0), (0, pad)))
+        words = np.ascontiguousarray(block).view(np.uint64)
+        hashes[y0:y0 + chunk_rows] = (words * weights).sum(axis=1, dtype=np.uint64)
+    return hashes
+
+# ========== Row Alignment ==========
+# Patience-style diff over row hashes: strip the common prefix and suffix, anchor on
+# rows that are unique on both sides, keep the longest increasing run of anchors and
+# recurse into the gaps. Opcodes follow difflib: (tag, a0, a1, b0, b1).
+def align_rows(a, b):
+    opcodes = []
+    _align(np.asarray(a), np.asarray(b), 0, len(a), 0, len(b), opcodes)
+    return _merge(opcodes)
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    mismatch = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatch[0]) if len(mismatch) else n
+
+def _align(a, b, a0, a1, b0, b1, opcodes):
+    prefix = _common_prefix(a[a0:a1], b[b0:b1])
+    if prefix:
+        opcodes.append(("equal", a0, a0 + prefix, b0, b0 + prefix))
+        a0, b0 = a0 + prefix, b0 + prefix
+    suffix = _common_prefix(a[a0:a1][::-1], b[b0:b1][::-1])
+    tail = ("equal", a1 - suffix, a1, b1 - suffix, b1) if suffix else None
+    a1, b1 = a1 - suffix, b1 - suffix
+
+    if a0 == a1 and b0 == b1:
+        pass
+    elif a0 == a1:
+        opcodes.append(("insert", a0, a0, b0, b1))
+    elif b0 == b1:
+        opcodes.append(("delete", a0, a1, b0, b0))
+    else:
+        anchors = _unique_anchors(a[a0:a1], b[b0:b1])
+        if not anchors:
+            _shift(a, b, a0, a1, b0, b1, opcodes)
+        else:
+            pa, pb = a0, b0
+            for ia, ib in anchors:
+                if pa < a0 + ia or pb < b0 + ib:
+                    _align(a, b, pa, a0 + ia, pb, b0 + ib, opcodes)
+                opcodes.append(("equal", a0 + ia, a0 + ia + 1, b0 + ib, b0 + ib + 1))
+                pa, pb = a0 + ia + 1, b0 + ib + 1
+            _align(a, b, pa, a1, pb, b1, opcodes)
+
+    if tail:
+        opcodes.append(tail)
+
+def _unique_anchors(a, b):
+    values_a, index_a, counts_a = np.unique(a, return_index=True, return_counts=True)
+    values_b, index_b, counts_b = np.unique(b, return_index=True, return_counts=True)
+    _, in_a, in_b = np.intersect1d(values_a[counts_a == 1], values_b[counts_b == 1],
+                                   assume_unique=True, return_indices=True)
+    if not len(in_a):
+        return []
+    pos_a = index_a[counts_a == 1][in_a]
+    pos_b = index_b[counts_b == 1][in_b]
+    order = np.argsort(pos_a)
+    return _longest_increasing(pos_a[order].tolist(), pos_b[order].tolist())
+
+def _shift(a, b, a0, a1, b0, b1, opcodes):
+    # No unique rows to anchor on (repeated UI rows, flat backgrounds): assume a single
+    # band was inserted or removed and put it where the fewest rows fail to line up
+    extra = (b1 - b0) - (a1 - a0)
+    short, long_ = (a[a0:a1], b[b0:b1]) if extra > 0 else (b[b0:b1], a[a0:a1])
+    n, d = len(short), abs(extra)
+    top = np.concatenate(([0], np.cumsum(short != long_[:n])))
+    bottom = np.concatenate((np.cumsum((short != long_[d:d + n])[::-1])[::-1], [0]))
+    k = int(np.argmin(top + bottom))
+    if extra > 0:
+        _positional(a, b, a0, a0 + k, b0, opcodes)
+        opcodes.append(("insert", a0 + k, a0 + k, b0 + k, b0 + k + d))
+        _positional(a, b, a0 + k, a1, b0 + k + d, opcodes)
+    else:
+        _positional(a, b, a0, a0 + k, b0, opcodes)
+        opcodes.append(("delete", a0 + k, a0 + k + d, b0 + k, b0 + k))
+        _positional(a, b, a0 + k + d, a1, b0 + k, opcodes)
+
+def _positional(a, b, a0, a1, b0, opcodes):
+    # Row-for-row runs of equal and replaced rows
+    if a0 == a1:
+        return
+    same = a[a0:a1] == b[b0:b0 + a1 - a0]
+    edges = np.flatnonzero(np.diff(same.astype(np.int8))) + 1
+    for s, e in zip(np.concatenate(([0], edges)), np.concatenate((edges, [a1 - a0]))):
+        opcodes.append(("equal" if same[s] else "replace", a0 + int(s), a0 + int(e), b0 + int(s), b0 + int(e)))
+
+def _longest_increasing(pos_a, pos_b):
+    # Longest run of anchors increasing in both images, O(k log k)
+    tails, tail_index, previous = [], [], [None] * len(pos_b)
+    for i, value in enumerate(pos_b):
+        k = bisect_left(tails, value)
+        previous[i] = tail_index[k - 1] if k else None
+        if k == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[k] = value
+            tail_index[k] = i
+    result = []
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        result.append((pos_a[i], pos_b[i]))
+        i = previous[i]
+    return result[::-1]
+
+def _merge(opcodes):
+    merged = []
+    for op in opcodes:
+        if op[1] == op[2] and op[3] == op[4]:
+            continue
+        if merged and merged[-1][0] == op[0] and merged[-1][2] == op[1] and merged[-1][4] == op[3]:
+            merged[-1] = (op[0], merged[-1][1], op[2], merged[-1][3], op[4])
+        else:
+            merged.append(op)
+    return merged
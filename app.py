@@ -1,22 +1,27 @@
+import time
+_SCRIPT_START = time.perf_counter()
 import streamlit as st
-import cv2
-import numpy as np
 from PIL import Image
-import io
 from io import BytesIO
-import time
-import base64
-from streamlit_drawable_canvas import st_canvas
-from playwright.sync_api import sync_playwright
-import os
-import subprocess
-
-# Ensure Playwright browsers are installed without Streamlit commands
-playwright_dir = os.path.expanduser("~/.cache/ms-playwright")
-if not os.path.exists(playwright_dir) or not os.listdir(playwright_dir):
-    print("Installing Playwright browsers...")  # Use print instead of st.write
-    subprocess.run(["playwright", "install", "chromium"], check=True)
-    print("Browsers installed!")
+import export
+import history_store
+import preview
+import timing
+
+# OpenCV/NumPy (via the engine), Playwright and the canvas component are imported on
+# first use, so the first render only pays for Streamlit and Pillow
+np = timing.lazy_import("numpy")
+engine = timing.lazy_import("engine")
+capture = timing.lazy_import("capture")
+baseline_index = timing.lazy_import("baseline_index")
+cache = timing.lazy_import("cache")
+drawable_canvas = timing.lazy_import("streamlit_drawable_canvas")
+
+def st_canvas(**kwargs):
+    return drawable_canvas.st_canvas(**kwargs)
+
+if timing.record_startup("imports_ms", _SCRIPT_START):
+    print(f"App imports took {timing.STARTUP['imports_ms']} ms")
 
 # ========== Configuration ==========
 COLORS = {
@@ -31,102 +36,203 @@ COLORS = {
 }
 
 # ========== Core Functions ==========
-def compare_images(baseline_img, new_img, tolerance=50):
-    try:
-        if not isinstance(baseline_img, Image.Image):
-            baseline_img = Image.open(baseline_img)
-        if not isinstance(new_img, Image.Image):
-            new_img = Image.open(new_img)
-
-        baseline_img = baseline_img.convert('RGB')
-        new_img = new_img.convert('RGB')
-
-        if baseline_img.size != new_img.size:
-            st.warning(f"Image sizes differ: Baseline {baseline_img.size}, New {new_img.size}. Resizing new image to match baseline.")
-            new_img = new_img.resize(baseline_img.size, Image.Resampling.LANCZOS)
+@st.cache_resource
+def get_memo():
+    # Process-wide, so decoded images and results survive reruns and are shared by sessions
+    return cache.LRUCache()
+
+def compare_images(baseline_img, new_img, tolerance=50, performance_mode=False, key=None, masks=None, timer=None,
+                   metric="pixel", ssim_threshold=None):
+    masks = masks or {}
+    if ssim_threshold is None:
+        ssim_threshold = engine.SSIM_THRESHOLD
+    computed = []
+    def compute():
+        computed.append(True)
+        if metric == "ssim":
+            return engine.compare_images_ssim(baseline_img, new_img, ssim_threshold, timer=timer, **masks)
+        if performance_mode:
+            return engine.compare_images_coarse_to_fine(baseline_img, new_img, tolerance, timer=timer, **masks)
+        return engine.compare_images(baseline_img, new_img, tolerance, timer=timer, **masks)
 
-        baseline_np = np.array(baseline_img)
-        new_np = np.array(new_img)
-
-        if baseline_np.shape != new_np.shape:
-            st.error(f"Shape mismatch after resize: Baseline {baseline_np.shape}, New {new_np.shape}")
-            return None, None, None
-
-        diff_np = cv2.absdiff(baseline_np, new_np)
-        gray_diff = cv2.cvtColor(diff_np, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray_diff, tolerance, 255, cv2.THRESH_BINARY)
-        
-        diff_pixels = np.count_nonzero(thresh)
-        total_pixels = thresh.size
-        diff_percent = (diff_pixels / total_pixels) * 100 if total_pixels > 0 else 0
-        
-        contours_data = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = contours_data[0] if len(contours_data) == 2 else contours_data[1]
-        
-        highlighted = baseline_np.copy()
-        for contour in contours:
-            if cv2.contourArea(contour) > 0:
-                x, y, w, h = cv2.boundingRect(contour)
-                cv2.rectangle(highlighted, (x, y), (x+w, y+h), (255, 71, 87), 2)
-        
-        return (
-            Image.fromarray(highlighted),
-            Image.fromarray(diff_np),
-            round(diff_percent, 2)
-        )
+    try:
+        result = get_memo().get_or_compute(key, compute) if key else compute()
     except Exception as e:
         st.error(f"Image processing error: {str(e)}")
-        return None, None, None
+        return None
+
+    for warning in result['warnings']:
+        st.warning(warning)
+    # A copy, so the memoized result itself never says whether it was a cache hit
+    return dict(result, cached=not computed)
 
-def capture_screenshot(url, width=1280, height=720):
+def apply_tolerance(result, tolerance):
+    # Diff % comes straight from the stored histogram; regions and the overlay are rebuilt on demand
+    if result.get('histogram') is None or result.get('tolerance') == tolerance:
+        return
+    result['diff_percent'] = engine.diff_percent_at(result['histogram'], tolerance)
+    result['regions'] = None
+    result['highlighted'] = None
+    result['tolerance'] = tolerance
+
+def apply_ssim_threshold(result, threshold):
+    # Block scores are kept, so moving the SSIM threshold only re-counts blocks
+    if result.get('ssim') is None or threshold is None or result['ssim']['threshold'] == threshold:
+        return
+    # The summary may be shared with the cached result, so replace it instead of mutating
+    result['ssim'] = dict(result['ssim'], threshold=threshold)
+    result['diff_percent'] = engine.ssim_diff_percent(result['ssim'], threshold)
+    result['regions'] = None
+    result['highlighted'] = None
+
+def current_regions(result):
+    if result['regions'] is None and result.get('ssim'):
+        result['regions'] = engine.ssim_regions(result['ssim'], result['ssim']['threshold'])
+    elif result['regions'] is None:
+        result['regions'] = engine.regions_at(result['gray_diff'], result['tolerance'], result.get('window'))
+    return result['regions']
+
+def current_highlighted(result):
+    if result['highlighted'] is None:
+        result['highlighted'] = engine.highlight_at(result['baseline'], current_regions(result), result['bands'])
+    return result['highlighted']
+
+def highlighted_key(result):
+    # The overlay depends on the result and the tolerance or SSIM threshold it was drawn at
+    summary = result.get('ssim')
+    return ("highlighted", result['key'], result['tolerance'], summary['threshold'] if summary else None)
+
+def shown(image, key, max_side=preview.SCREEN_SIDE):
+    # What st.image gets: a cached preview level, or the original when full resolution is on
+    if st.session_state.get('full_resolution'):
+        return image
+    return preview.preview(get_memo(), key, image, max_side)
+
+@st.cache_resource
+def get_exporter():
+    # One encoding thread per server process; encoded files share the LRU cache
+    return export.Exporter(get_memo())
+
+def report_entry(result, name):
+    # The current comparison as a report bundle entry, reusing any downloads already encoded
+    summary = result.get('ssim')
+    details = {"Difference %": result['diff_percent'],
+               "Metric": "SSIM" if summary else "Pixel difference",
+               "Threshold": summary['threshold'] if summary else result['tolerance'],
+               "Size": f"{result['baseline'].size[0]}x{result['baseline'].size[1]}",
+               "Changed regions": len(current_regions(result)),
+               "Annotations": len(result.get('annotations') or [])}
+    if summary:
+        details["SSIM"] = summary['score']
+    return {"name": name or "Comparison", "summary": details,
+            "images": {"baseline": (result['baseline_key'], result['baseline']),
+                       "new": (result['new_key'], result['new_image']),
+                       "highlighted": (highlighted_key(result), current_highlighted(result)),
+                       "heatmap": (("diff", result['key']), result['diff_img'])}}
+
+@st.cache_resource
+def get_browser_setup():
+    # Installs Chromium in the background the first time a session picks URL capture
+    return capture.BrowserSetup()
+
+@st.cache_resource
+def get_capture_pool():
+    # One browser per server process, reused by every session and rerun
+    return capture.BackgroundBrowserPool(size=2)
+
+def capture_screenshot(url, width=1280, height=720, full_page=False):
     try:
-        with sync_playwright() as p:
-            st.write("Launching browser...")  # Debug
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.set_viewport_size({"width": width, "height": height})
-            page.goto(url, wait_until="networkidle")
-            screenshot_bytes = page.screenshot(full_page=False)
-            browser.close()
-            st.write("Screenshot captured successfully!")  # Debug
-            return Image.open(BytesIO(screenshot_bytes))
+        record = get_capture_pool().capture(url, width, height, full_page)
+        if record['error']:
+            raise RuntimeError(record['error'])
+        timings = ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in record['timings'].items())
+        st.caption(f"Captured in {timings}")
+        return Image.open(BytesIO(record['png']))
     except Exception as e:
         st.error(f"Screenshot capture failed: {str(e)}")
         return None
 
 # ========== Utility Functions ==========
-def handle_history():  # Unchanged
-    if 'history' not in st.session_state:
-        st.session_state.history = []
-    
+@st.cache_resource
+def get_history_store():
+    return history_store.HistoryStore()
+
+def history_image(store, key, larger=False):
+    if not larger:
+        return store.thumbnail(key)
+    return preview.preview(get_memo(), key, lambda: store.image(key))
+
+def handle_history(timer=None):
     if 'current_result' in st.session_state and st.session_state.current_result:
         result = st.session_state.current_result
-        history_entry = {
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "diff_percent": result['diff_percent'],
-            "baseline": image_to_base64(result['baseline']),
-            "new_image": image_to_base64(result['new_image']),
-            "highlighted": image_to_base64(result['highlighted']),
-            "annotations": result.get('annotations', [])
-        }
-        st.session_state.history.insert(0, history_entry)
-        st.session_state.history = st.session_state.history[:10]
-
-def image_to_base64(image):  # Unchanged
+        try:
+            get_history_store().add(
+                result['baseline'],
+                result['new_image'],
+                current_highlighted(result),
+                result['diff_percent'],
+                tolerance=result.get('tolerance'),
+                annotations=result.get('annotations', []),
+                timer=timer
+            )
+        except Exception as e:
+            st.error(f"Failed to save history: {str(e)}")
+
+def record_changes(result, timer=None):
+    # Every comparison actually run adds its regions to the baseline's change map, in place
     try:
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
-    except Exception:
-        return ""
+        get_history_store().record_changes(result['baseline_key'], result['baseline'].size, current_regions(result),
+                                           result['diff_percent'], timer=timer)
+    except Exception as e:
+        st.error(f"Failed to update the change map: {str(e)}")
+
+@st.cache_resource
+def get_baseline_index():
+    # Loaded once per server process; baselines approved elsewhere are picked up by id
+    return baseline_index.BaselineIndex(get_history_store())
+
+def image_hash(name):
+    # Perceptual hash of the baseline/new image held in session state, cached by content key
+    return get_memo().get_or_compute(("dhash", image_key_for(name)),
+                                     lambda: baseline_index.dhash(st.session_state[f"{name}_img"]))
 
-def base64_to_image(base64_str):  # Unchanged
+def approve_baseline(image, name=None):
     try:
-        return Image.open(BytesIO(base64.b64decode(base64_str)))
-    except Exception:
-        return None
+        get_baseline_index().approve(image, name)
+        return True
+    except Exception as e:
+        st.error(f"Failed to approve baseline: {str(e)}")
+        return False
 
-def annotation_tool(image):  # Unchanged
+def baseline_suggestions():
+    # Nearest approved baselines to the new image, so the matching one needn't be uploaded by hand
+    if st.session_state.get('new_img') is None:
+        return
+    try:
+        matches = get_baseline_index().nearest(image_hash('new'))
+    except Exception as e:
+        st.error(f"Baseline lookup failed: {str(e)}")
+        return
+    if not matches:
+        return
+    store = get_history_store()
+    with st.expander(f"🔎 Similar approved baselines ({len(matches)})", expanded=st.session_state.get('baseline_img') is None):
+        for match in matches:
+            col_thumb, col_info = st.columns([1, 2])
+            with col_thumb:
+                st.image(store.thumbnail(match['image']))
+            with col_info:
+                st.write(f"**{match['name'] or 'Unnamed'}**  \n{match['width']}x{match['height']}, approved {match['approved']}, "
+                         f"{match['distance']} of 64 hash bits differ")
+                if st.button("Use as baseline", key=f"use_baseline_{match['id']}"):
+                    try:
+                        st.session_state.baseline_img = store.image(match['image'])
+                        st.session_state.baseline_key = None
+                        st.success("Baseline selected.")
+                    except Exception as e:
+                        st.error(f"Failed to load baseline: {str(e)}")
+
+def annotation_tool(image, key):
     try:
         if not isinstance(image, Image.Image):
             image = Image.fromarray(image) if isinstance(image, np.ndarray) else Image.open(image)
@@ -134,7 +240,8 @@ def annotation_tool(image):  # Unchanged
         if not hasattr(image, 'size') or image.size[0] == 0 or image.size[1] == 0:
             raise ValueError("Invalid image dimensions")
         
-        canvas_key = f"canvas_{int(time.time()*1000)}"
+        # Stable per result, so reruns reuse the mounted canvas instead of re-sending the background
+        canvas_key = f"canvas_{key}"
         return st_canvas(
             fill_color="rgba(57, 255, 20, 0.3)",
             stroke_width=2,
@@ -150,6 +257,47 @@ def annotation_tool(image):  # Unchanged
         st.error(f"Annotation error: {str(e)}")
         return None
 
+def load_masks(baseline_key):
+    try:
+        return get_history_store().masks(baseline_key)
+    except Exception as e:
+        st.error(f"Failed to load masks: {str(e)}")
+        return {"ignore": [], "include": []}
+
+def save_masks(baseline_key, ignore, include):
+    try:
+        get_history_store().set_masks(baseline_key, ignore, include)
+        return True
+    except Exception as e:
+        st.error(f"Failed to save masks: {str(e)}")
+        return False
+
+def annotation_rects(objects):
+    # Canvas rectangles as (x, y, w, h) in image pixels; resized shapes carry a scale
+    rects = []
+    for obj in objects or []:
+        if obj.get("type") != "rect":
+            continue
+        w = obj.get("width", 0) * obj.get("scaleX", 1)
+        h = obj.get("height", 0) * obj.get("scaleY", 1)
+        if w > 0 and h > 0:
+            rects.append([int(round(obj.get("left", 0))), int(round(obj.get("top", 0))), int(round(w)), int(round(h))])
+    return rects
+
+def pixels_for(name):
+    # The cached RGB array of an upload, so the engine copies it instead of converting
+    # the PIL image again; captures and evicted uploads fall back to the image
+    array = get_memo().get(("rgb", image_key_for(name)))
+    return array if array is not None else st.session_state[f"{name}_img"]
+
+def image_key_for(name):
+    # Content key of the baseline/new image held in session state
+    key = st.session_state.get(f"{name}_key")
+    if key is None:
+        key = cache.image_key(st.session_state[f"{name}_img"])
+        st.session_state[f"{name}_key"] = key
+    return key
+
 # ========== UI Components ==========
 def main_interface():  # Unchanged
     st.title("Visual Regression Analyzer")
@@ -167,11 +315,17 @@ def main_interface():  # Unchanged
         if baseline_file:
             with st.spinner("Loading..."):
                 try:
-                    st.session_state.baseline_img = Image.open(baseline_file)
-                    st.image(st.session_state.baseline_img, use_container_width=True)
+                    st.session_state.baseline_img, st.session_state.baseline_key = cache.decode_image(get_memo(), baseline_file.getvalue())
+                    st.image(cache.decode_preview(get_memo(), baseline_file.getvalue(), st.session_state.baseline_key), use_container_width=True)
                 except Exception as e:
                     st.error(f"Failed to load baseline image: {str(e)}")
                     st.session_state.baseline_img = None
+                    st.session_state.baseline_key = None
+            if st.session_state.baseline_img and st.button("📌 Add to Baseline Index", help="Approve this image, so later screenshots of the same page suggest it."):
+                if approve_baseline(st.session_state.baseline_img, baseline_file.name):
+                    st.success("Added to the baseline index.")
+        # Filled in once the new image is known, further down
+        suggestions = st.container()
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
@@ -189,11 +343,13 @@ def main_interface():  # Unchanged
             if new_file:
                 with st.spinner("Loading..."):
                     try:
-                        st.session_state.new_img = Image.open(new_file)
-                        st.image(st.session_state.new_img, use_container_width=True)
+                        st.session_state.new_img, st.session_state.new_key = cache.decode_image(get_memo(), new_file.getvalue())
+                        st.session_state.new_name = new_file.name
+                        st.image(cache.decode_preview(get_memo(), new_file.getvalue(), st.session_state.new_key), use_container_width=True)
                     except Exception as e:
                         st.error(f"Failed to load new image: {str(e)}")
                         st.session_state.new_img = None
+                        st.session_state.new_key = None
         else:
             url = st.text_input("Enter URL", placeholder="https://example.com")
             with st.expander("Capture Settings"):
@@ -203,20 +359,37 @@ def main_interface():  # Unchanged
                 if aspect_ratio:
                     height = int(width / 16 * 9)
                     st.write(f"Height adjusted to: {height}px (16:9)")
+                full_page = st.checkbox("Full Page", value=False, help="Capture the whole scrollable page, not just the viewport.")
             
-            if st.button("🌐 Capture Screenshot"):
+            setup = get_browser_setup()
+            if setup.state == "checking":
+                # Finding installed browsers takes a directory listing; installing takes minutes
+                setup.wait(1)
+            if setup.state == "installing":
+                st.info("Installing the Chromium browser for captures in the background. Capture is enabled once it finishes.")
+            elif setup.state == "failed":
+                st.error(f"Browser installation failed: {setup.error}")
+
+            if st.button("🌐 Capture Screenshot", disabled=not setup.ready):
                 if url:
                     with st.spinner("Capturing screenshot..."):
-                        new_img = capture_screenshot(url, width, height)
+                        new_img = capture_screenshot(url, width, height, full_page)
                         if new_img:
                             st.session_state.new_img = new_img
-                            st.image(new_img, use_container_width=True)
+                            st.session_state.new_key = cache.image_key(new_img)
+                            st.session_state.new_name = f"{url} @ {width}x{height}"
+                            st.image(preview.preview(get_memo(), st.session_state.new_key, new_img), use_container_width=True)
                         else:
                             st.session_state.new_img = None
+                            st.session_state.new_key = None
                 else:
                     st.warning("Please enter a valid URL.")
         st.markdown('</div>', unsafe_allow_html=True)
 
+    if not baseline_file:
+        with suggestions:
+            baseline_suggestions()
+
     st.markdown("---")
     if st.button("🚀 Run Visual Analysis", use_container_width=True):
         baseline_img = st.session_state.get('baseline_img')
@@ -225,47 +398,168 @@ def main_interface():  # Unchanged
         if baseline_img and new_img:
             with st.spinner("Analyzing..."):
                 progress = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.01)
-                    progress.progress(i + 1)
-                highlighted_img, diff_img, diff_percent = compare_images(
-                    baseline_img, new_img, st.session_state.tolerance
+                done = [0.0]
+
+                def on_stage(name):
+                    # Both images pass through decode/rgb, so only ever move forward
+                    fraction = timing.stage_progress(name)
+                    if fraction is not None and fraction > done[0]:
+                        done[0] = fraction
+                        progress.progress(fraction, text=f"{name.replace('_', ' ')} done")
+
+                timer = timing.StageTimer(on_stage)
+                masks = load_masks(image_key_for('baseline'))
+                result_key = cache.params_key(
+                    image_key_for('baseline'), image_key_for('new'),
+                    st.session_state.tolerance, st.session_state.performance_mode, masks, st.session_state.metric
+                )
+                result = compare_images(
+                    pixels_for('baseline'), pixels_for('new'), st.session_state.tolerance,
+                    st.session_state.performance_mode, key=result_key, masks=masks, timer=timer,
+                    metric=st.session_state.metric, ssim_threshold=st.session_state.ssim_threshold
                 )
-                progress.empty()
                 
-                if highlighted_img:
+                if result:
                     st.session_state.current_result = {
                         'baseline': baseline_img,
                         'new_image': new_img,
-                        'highlighted': highlighted_img,
-                        'diff_img': diff_img,
-                        'diff_percent': diff_percent,
+                        'highlighted': result['highlighted'],
+                        'diff_img': result['diff_img'],
+                        'diff_percent': result['diff_percent'],
+                        'histogram': result['histogram'],
+                        'gray_diff': result['gray_diff'],
+                        'window': result.get('window'),
+                        'regions': result['regions'],
+                        'bands': result['bands'],
+                        'checked_pixels': result['checked_pixels'],
+                        'ssim': result.get('ssim'),
+                        'masks': masks,
+                        'baseline_key': image_key_for('baseline'),
+                        'new_key': image_key_for('new'),
+                        'tolerance': st.session_state.tolerance,
+                        'key': result_key,
                         'annotations': []
                     }
-                    handle_history()
-                    show_results()
+                    handle_history(timer)
+                    # Repeat clicks served from the memo would count the same comparison again
+                    if not result['cached']:
+                        record_changes(st.session_state.current_result, timer)
+                    st.session_state.current_result['timings'] = dict(timer.record(), cached=result['cached'])
+                progress.empty()
         else:
             st.warning("Please upload both images or capture a screenshot.")
 
+    # Rendered on every rerun so moving the tolerance slider updates the result in place
+    show_results()
+
+def mask_controls(result):
+    # Drawn rectangles become masks of the baseline, applied to every later comparison against it
+    rects = annotation_rects(result.get('annotations'))
+    masks = load_masks(result['baseline_key'])
+    col_ignore, col_include, col_clear = st.columns(3)
+    saved = False
+    with col_ignore:
+        if st.button("🚫 Ignore drawn areas", disabled=not rects, help="Never compare these pixels (timestamps, ads, carousels)."):
+            saved = save_masks(result['baseline_key'], masks['ignore'] + rects, masks['include'])
+    with col_include:
+        if st.button("🎯 Only check drawn areas", disabled=not rects, help="Compare only inside these rectangles."):
+            saved = save_masks(result['baseline_key'], masks['ignore'], masks['include'] + rects)
+    with col_clear:
+        if st.button("🧹 Clear masks", disabled=not (masks['ignore'] or masks['include'])):
+            saved = save_masks(result['baseline_key'], [], [])
+    if saved:
+        st.success("Masks saved for this baseline. Run the analysis again to apply them.")
+
+def change_history(result):
+    # Where this baseline keeps changing across runs, from its accumulated change map
+    store = get_history_store()
+    key = result['baseline_key']
+    try:
+        change_map = store.change_map(key)
+    except Exception as e:
+        st.error(f"Failed to load the change map: {str(e)}")
+        return
+    if not change_map or (change_map['width'], change_map['height']) != result['baseline'].size:
+        return
+    runs, cell, counts = change_map['runs'], change_map['cell'], change_map['counts']
+    st.markdown(f"#### 📊 Change Frequency ({runs} run{'s' if runs != 1 else ''} against this baseline)")
+    overlay = preview.preview(get_memo(), ("change_overlay", key, runs),
+                              lambda: engine.change_overlay(result['baseline'], counts, runs, cell))
+    st.image(overlay, use_container_width=True)
+    st.caption("Tinted cells changed in at least one run; the brighter the tint, the more runs changed them.")
+
+    share = st.slider("Flag areas changing in at least (% of runs)", 5, 100, 20, 5, key="frequent_share")
+    frequent = engine.frequent_regions(counts, runs, cell, share / 100)
+    if frequent:
+        st.dataframe(frequent, use_container_width=True)
+        if st.button("🚫 Ignore frequently changing areas", help="Save these areas as ignore masks for this baseline."):
+            masks = load_masks(key)
+            rects = [[r['x'], r['y'], r['w'], r['h']] for r in frequent]
+            if save_masks(key, masks['ignore'] + rects, masks['include']):
+                st.success("Masks saved for this baseline. Run the analysis again to apply them.")
+    trend = store.change_trend(key)
+    if len(trend) > 1:
+        st.line_chart([row['diff_percent'] for row in trend])
+        st.caption(f"Difference % of the last {len(trend)} runs against this baseline, oldest first.")
+
+def zoom_controls(result, highlighted, regions):
+    # Full-resolution crops around one changed region, next to the same pixels of the new image
+    choice = st.selectbox("🔍 Zoom into region", [None] + list(range(len(regions))),
+                          format_func=lambda i: "None" if i is None else
+                          f"#{i + 1}: {regions[i]['w']}x{regions[i]['h']} at ({regions[i]['x']}, {regions[i]['y']})")
+    if choice is None:
+        return
+    box = tuple(regions[choice][field] for field in ("x", "y", "w", "h"))
+    col_a, col_b = st.columns(2)
+    with col_a:
+        st.image(preview.zoom(highlighted, box), caption="Differences (full resolution)", use_container_width=True)
+    with col_b:
+        # With a layout shift the new image's rows no longer line up with the baseline's
+        if result['bands']:
+            st.caption("Rows were inserted or removed, so the new image is not shown at the same position.")
+        else:
+            st.image(preview.zoom(result['new_image'], box), caption="New Version (full resolution)", use_container_width=True)
+
 def show_results():
     result = st.session_state.get('current_result')
     if not result:
         return
     
-    diff = result['diff_percent']
     tolerance = st.session_state.tolerance
+    apply_tolerance(result, tolerance)
+    apply_ssim_threshold(result, st.session_state.ssim_threshold)
+    summary = result.get('ssim')
+    diff = result['diff_percent']
     use_thresholds = st.session_state.get('use_thresholds', False)
     pass_th = st.session_state.get('pass_threshold', 10)
     fail_th = st.session_state.get('fail_threshold', 70)
 
     # Summary Section
     st.markdown("### Comparison Summary")
-    st.write(f"**Difference**: {diff}% of pixels changed with tolerance {tolerance}.")
+    if summary:
+        st.write(f"**Difference**: {diff}% of pixels are in blocks with SSIM below {summary['threshold']} "
+                 f"(global SSIM {summary['score']}).")
+    else:
+        st.write(f"**Difference**: {diff}% of pixels changed with tolerance {tolerance}.")
     if diff == 0:
         st.success("🎉 No differences found—images match perfectly!")
     else:
-        st.write(f"Out of {result['baseline'].size[0]*result['baseline'].size[1]} pixels, {int(diff/100 * result['baseline'].size[0]*result['baseline'].size[1])} changed.")
-        if tolerance == 0:
+        total = result['checked_pixels']
+        st.write(f"Out of {total} pixels, {int(diff/100 * total)} changed.")
+        if result['masks']['ignore'] or result['masks']['include']:
+            st.info(f"🎭 Masks for this baseline: {len(result['masks']['ignore'])} ignored area(s), "
+                    f"{len(result['masks']['include'])} region(s) of interest; {total} pixels compared.")
+        for band in result['bands']:
+            if band['type'] == 'inserted':
+                start, end = band['new_rows']
+                st.info(f"↕️ Layout shift: {end - start} new rows inserted at baseline row {band['baseline_row']} (blue line).")
+            else:
+                start, end = band['baseline_rows']
+                st.info(f"↕️ Layout shift: baseline rows {start}-{end} were removed.")
+        if summary:
+            st.info(f"ℹ️ SSIM threshold is {summary['threshold']}: {summary['block']}×{summary['block']} px blocks less "
+                    f"structurally similar than this count as changed. Anti-aliasing and font-rendering jitter score close to 1.")
+        elif tolerance == 0:
             st.info("ℹ️ Tolerance is 0: Every tiny change counts (e.g., a 1-point color shift).")
         else:
             st.info(f"ℹ️ Tolerance is {tolerance}: Only changes bigger than {tolerance} (out of 255) are counted.")
@@ -286,31 +580,93 @@ def show_results():
         else:
             st.write("Toggle 'Use Thresholds' in Settings to set your own pass/fail limits.")
 
-    tab1, tab2, tab3, tab4 = st.tabs(["Side-by-Side", "Differences", "Heatmap", "Guide"])
+    st.toggle("🔍 Full resolution", key="full_resolution",
+              help="Show the original images instead of screen-size previews. Slow for 4K and full-page screenshots.")
+    tab1, tab2, tab3, tab_sweep, tab4 = st.tabs(["Side-by-Side", "Differences", "Heatmap", "Tolerance Sweep", "Guide"])
     
     with tab1:
         col_a, col_b = st.columns(2)
         with col_a:
-            st.image(result['baseline'], caption="Baseline", use_container_width=True)
+            st.image(shown(result['baseline'], result['baseline_key']), caption="Baseline", use_container_width=True)
         with col_b:
-            st.image(result['new_image'], caption="New Version", use_container_width=True)
+            st.image(shown(result['new_image'], result['new_key']), caption="New Version", use_container_width=True)
     
     with tab2:
-        canvas_result = annotation_tool(result['highlighted'])
-        if canvas_result and hasattr(canvas_result, 'json_data') and canvas_result.json_data:
-            result['annotations'] = canvas_result.json_data.get("objects", [])
-        st.image(result['highlighted'], caption="Differences Highlighted", use_container_width=True)
-        st.caption("Red boxes show where the new image differs from the baseline.")
+        # Every tab body runs on every rerun, so regions and the overlay are only built
+        # while the toggle is on; otherwise moving the tolerance just re-reads the histogram
+        if st.toggle("🟥 Show overlay", key="show_overlay",
+                     help="Find the changed regions and draw them. Needed for annotating, zooming and masks from drawn areas."):
+            highlighted = current_highlighted(result)
+            # The canvas always draws on the screen-size preview; shapes are scaled back to image pixels
+            canvas_image = preview.preview(get_memo(), highlighted_key(result), highlighted)
+            canvas_result = annotation_tool(canvas_image, f"{result['key']}_{result['tolerance']}")
+            if canvas_result and hasattr(canvas_result, 'json_data') and canvas_result.json_data:
+                result['annotations'] = preview.to_full_resolution(canvas_result.json_data.get("objects", []),
+                                                                   highlighted.size, canvas_image.size)
+            st.image(shown(highlighted, highlighted_key(result)), caption="Differences Highlighted", use_container_width=True)
+            st.caption("Red boxes show where the new image differs from the baseline.")
+            regions = current_regions(result)
+            if regions:
+                with st.expander(f"Changed regions ({len(regions)})"):
+                    st.dataframe(regions, use_container_width=True)
+                zoom_controls(result, highlighted, regions)
+        else:
+            st.caption("Turn on 'Show overlay' to see where the images differ.")
+        mask_controls(result)
         if st.button("💾 Save to History"):
             handle_history()
             st.success("Saved!")
+        if st.button("✅ Approve as Baseline", help="Add the new version to the baseline index, so later screenshots of this page suggest it."):
+            if approve_baseline(result['new_image'], st.session_state.get('new_name')):
+                st.success("Approved! Later screenshots of this page will suggest it as their baseline.")
 
     with tab3:
-        st.image(result['diff_img'], use_container_width=True)
-        st.caption("Heatmap: Bright spots show bigger differences.")
+        st.image(shown(result['diff_img'], ("diff", result['key'])), use_container_width=True)
+        if summary:
+            st.caption("Heatmap: From black through purple to yellow, blocks are structurally less similar (1 - SSIM).")
+        else:
+            st.caption("Heatmap: From black through purple to yellow, pixels changed more. Small differences are stretched so they stay visible.")
+        change_history(result)
+
+    with tab_sweep:
+        if summary:
+            st.line_chart(engine.ssim_sweep(summary))
+            st.caption(f"Difference % (y) at every SSIM threshold from 0 to 1 (x, in hundredths). "
+                       f"Current threshold {summary['threshold']} gives {diff}%.")
+        else:
+            st.line_chart(engine.tolerance_sweep(result['histogram']))
+            st.caption(f"Difference % (y) at every tolerance from 0 to 255 (x). Current tolerance {tolerance} gives {diff}%.")
 
     with tab4:
-        st.markdown("""
+        if summary:
+            st.markdown("""
+        ### Your Visual Regression Guide
+        This tool compares your *baseline* (the original) to a *new version* and shows how much changed.
+
+        #### What Does {diff}% Mean?
+        - **{diff}% of pixels** lie in {block}×{block} px blocks whose SSIM (structural similarity) is below {threshold}.
+        - **SSIM** is 1 for blocks with identical structure and drops as edges, text and shapes change. The whole image scores {score}.
+        - **Example**: Anti-aliasing or font-rendering jitter keeps a block near 1, while moved or rewritten text pulls it well below.
+
+        #### How the SSIM Threshold Works
+        - **Close to 1**: Flags almost any structural change, including subtle ones.
+        - **0.75**: The default. Ignores rendering noise, flags real edits.
+        - **0.5 or lower**: Only flags blocks that look very different. Try this for rough checks.
+        - **Tune it**: Slide 'SSIM Threshold' in Settings and watch the 'Tolerance Sweep' tab, which plots the % at every threshold.
+
+        #### Is {diff}% Okay?
+        - **0–10%**: Usually fine—minor or no issues.
+        - **10–40%**: Check the red boxes. Could be okay (e.g., text edits) or a problem (e.g., layout shift).
+        - **40%+**: Likely significant. Look at 'Differences' to decide.
+        - **Your Call**: Toggle 'Use Thresholds' in Settings to set what’s “pass” or “fail” for your project.
+
+        #### Tips
+        - **Color-only changes**: SSIM looks at structure, so switch to 'Pixel difference' to catch recolored elements.
+        - **Check Highlights**: The 'Differences' tab shows *where* it changed.
+        - **Set Limits**: Use thresholds (e.g., Pass < 10%, Fail > 70%) to automate decisions.
+        """.format(diff=diff, block=summary['block'], threshold=summary['threshold'], score=summary['score']))
+        else:
+            st.markdown("""
         ### Your Visual Regression Guide
         This tool compares your *baseline* (the original) to a *new version* and shows how much changed.
 
@@ -341,27 +697,81 @@ def show_results():
     with col_metrics[0]:
         st.markdown(f"<div class='metric-card'><h3>📈 Difference</h3><h1>{diff}%</h1></div>", unsafe_allow_html=True)
     with col_metrics[1]:
-        st.markdown(f"<div class='metric-card'><h3>⚖️ Tolerance</h3><h1>{tolerance}</h1></div>", unsafe_allow_html=True)
+        if summary:
+            st.markdown(f"<div class='metric-card'><h3>⚖️ SSIM</h3><h1>{summary['score']}</h1></div>", unsafe_allow_html=True)
+        else:
+            st.markdown(f"<div class='metric-card'><h3>⚖️ Tolerance</h3><h1>{tolerance}</h1></div>", unsafe_allow_html=True)
     with col_metrics[2]:
         st.markdown(f"<div class='metric-card'><h3>📐 Dimensions</h3><h1>{result['baseline'].size[0]}x{result['baseline'].size[1]}</h1></div>", unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
+    if st.session_state.get('show_timings') and result.get('timings'):
+        with st.expander("⏱️ Timings", expanded=True):
+            timings = result['timings']
+            st.table([{"Stage": stage, "ms": ms} for stage, ms in timings['stages'].items()])
+            note = " (comparison served from cache)" if timings['cached'] else ""
+            st.caption(f"Total: {timings['total_ms']} ms{note}")
+
     with st.expander("💾 Export Results"):
-        col_dl = st.columns(2)
-        with col_dl[0]:
-            buf = BytesIO()
-            result['highlighted'].save(buf, format="PNG")
-            st.download_button("Download Highlighted", buf.getvalue(), "differences.png", type="primary")
-        with col_dl[1]:
-            buf = BytesIO()
-            result['diff_img'].save(buf, format="PNG")
-            st.download_button("Download Heatmap", buf.getvalue(), "heatmap.png", type="primary")
+        export_controls(result)
+
+def export_controls(result):
+    # Nothing is encoded until a download is clicked; files are then encoded on the
+    # export thread and cached, so repeat downloads and reruns cost nothing
+    col_format, col_level = st.columns(2)
+    with col_format:
+        fmt = st.selectbox("Format", list(export.FORMATS), format_func=lambda f: export.FORMATS[f]['label'], key="export_format")
+    with col_level:
+        if fmt == "png":
+            level = st.slider("PNG Compression", 0, 9, export.PNG_LEVEL, key="export_png_level",
+                              help="Lower is faster to encode and gives larger files.")
+        else:
+            level = export.PNG_LEVEL
+    exporter = get_exporter()
+    extension, mime = export.FORMATS[fmt]['extension'], export.FORMATS[fmt]['mime']
+    # The overlay is a loader too, so it is only drawn if it is downloaded before being shown
+    highlighted, highlighted_id = lambda: current_highlighted(result), highlighted_key(result)
+    heatmap, heatmap_id = result['diff_img'], ("diff", result['key'])
+
+    col_dl = st.columns(3)
+    with col_dl[0]:
+        st.download_button("Download Highlighted", lambda: exporter.encoded(highlighted_id, highlighted, fmt, level),
+                           f"differences{extension}", mime, type="primary")
+    with col_dl[1]:
+        st.download_button("Download Heatmap", lambda: exporter.encoded(heatmap_id, heatmap, fmt, level),
+                           f"heatmap{extension}", mime, type="primary")
+    with col_dl[2]:
+        # Regions and the overlay for the entry are only worked out once the button is clicked
+        name = st.session_state.get('new_name')
+        st.download_button("📦 Download Report (ZIP)", lambda: exporter.bundle([report_entry(result, name)], fmt, level).result(),
+                           "report.zip", "application/zip", help="HTML summary with all images of this comparison.")
+
+    store = get_history_store()
+    total = store.count()
+    if total:
+        col_count, col_batch = st.columns(2)
+        with col_count:
+            count = st.number_input("Comparisons from history", 1, total, min(total, 20), key="export_batch_size")
+        with col_batch:
+            st.download_button("📦 Download History Report (ZIP)",
+                               lambda: exporter.bundle(export.history_entries(store, count), fmt, level).result(),
+                               "history-report.zip", "application/zip",
+                               help="The most recent comparisons in one HTML report. Images are read and encoded one at a time.")
 
 def sidebar_content():
     with st.sidebar:
         st.header("⚙️ Settings")
         st.session_state.tolerance = st.slider("Tolerance", 0, 255, 50, help="Set how big a change counts (0 = every difference, 255 = huge changes only).")
-        st.session_state.performance_mode = st.checkbox("🚀 Performance Mode", value=False)
+        metric = st.radio("Metric", ("Pixel difference", "SSIM"), horizontal=True,
+                          help="Pixel difference counts pixels whose gray difference exceeds the tolerance. SSIM compares the structure of 16×16 blocks, ignoring anti-aliasing and rendering jitter.")
+        st.session_state.metric = "ssim" if metric == "SSIM" else "pixel"
+        if st.session_state.metric == "ssim":
+            st.session_state.ssim_threshold = st.slider("SSIM Threshold", 0.0, 1.0, engine.SSIM_THRESHOLD, 0.01, help="Blocks scoring below this count as changed (1 = identical structure).")
+        st.session_state.performance_mode = st.checkbox("🚀 Performance Mode", value=False, help="Only diff the tiles that changed. Same results, much faster on mostly identical screenshots.")
+        st.session_state.show_timings = st.checkbox("⏱️ Show Timings", value=False, help="Show how long each stage of the last analysis took.")
+        if st.session_state.show_timings:
+            with st.expander("🚀 Startup"):
+                st.table(timing.startup_report())
         
         st.subheader("Thresholds")
         st.session_state.use_thresholds = st.checkbox("Use Pass/Fail Thresholds", value=False, help="Turn on to set your own pass/fail limits.")
@@ -387,14 +797,19 @@ def sidebar_content():
         
         st.markdown("---")
         st.header("🕒 History")
-        if st.session_state.get('history'):
-            for entry in st.session_state.history[:3]:
+        store = get_history_store()
+        total = store.count()
+        if total:
+            st.caption(f"{total} comparisons stored")
+            for entry in store.recent(3):
                 with st.expander(f"{entry['timestamp']} - {entry['diff_percent']}%"):
+                    # Thumbnails are cheap; the larger preview reads the image from disk once and caches its pyramid
+                    larger = st.checkbox("Larger preview", key=f"history_full_{entry['id']}")
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.image(base64_to_image(entry['baseline']), caption="Baseline")
+                        st.image(history_image(store, entry['baseline'], larger), caption="Baseline")
                     with col2:
-                        st.image(base64_to_image(entry['highlighted']), caption="Differences")
+                        st.image(history_image(store, entry['highlighted'], larger), caption="Differences")
                     if entry['annotations']:
                         st.markdown("**Annotations:**")
                         st.json(entry['annotations'])
@@ -498,11 +913,16 @@ def main():
 
     defaults = {
         'performance_mode': False,
+        'show_timings': False,
         'tolerance': 50,
+        'metric': 'pixel',
+        'ssim_threshold': None,
         'baseline_img': None,
         'new_img': None,
+        'baseline_key': None,
+        'new_key': None,
+        'new_name': None,
         'current_result': None,
-        'history': [],
         'use_thresholds': False,
         'pass_threshold': 10,
         'fail_threshold': 70
@@ -513,6 +933,8 @@ def main():
 
     sidebar_content()
     main_interface()
+    if timing.record_startup("first_render_ms", _SCRIPT_START):
+        print(f"First render took {timing.STARTUP['first_render_ms']} ms")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from itertools import combinations
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import ingest
+from history_store import HistoryStore
+
+CHUNKS = 4
+CHUNK_BITS = 16
+# dHashes further apart than this are treated as different pages
+MAX_DISTANCE = 10
+# Below this many baselines a vectorized scan beats probing the tables. With NumPy 2's
+# bitwise_count that holds up to about a million hashes, with the byte-table popcount
+# fallback only up to a few thousand.
+SCAN_BELOW = 1_000_000 if hasattr(np, "bitwise_count") else 4096
+# New baselines wait in an unsorted tail until it is this large (or an eighth of the index)
+TAIL_SIZE = 256
+
+# ========== Perceptual Hash ==========
+def dhash(source):
+    # 64-bit difference hash: the image shrunk to 9x8 gray, one bit per pair of
+    # horizontally adjacent cells. Re-renders of the same page land a few bits apart.
+    gray = cv2.cvtColor(ingest.to_rgb(source), cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return int(np.packbits(small[:, 1:] > small[:, :-1]).view(">u8")[0])
+
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def hamming(hashes, query):
+    diff = hashes ^ np.uint64(query)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diff)
+    return _BYTE_BITS[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _to_unsigned(value):
+    # SQLite integers are signed 64-bit
+    return value & (2 ** 64 - 1)
+
+def _to_signed(value):
+    return value - 2 ** 64 if value >= 2 ** 63 else value
+
+# ========== Multi-Index Hashing ==========
+# Every hash is split into four 16-bit chunks and each chunk position gets its own
+# sorted table. Two hashes at distance d agree to within d // 4 bits on at least one
+# chunk, so probing each table with the query chunk and its values up to s bit flips
+# away finds every hash within 4s + 3 while only touching the matching entries.
+_PROBES = {}
+
+def _probes(radius):
+    # XOR masks of every 16-bit value within radius bit flips of a chunk
+    if radius not in _PROBES:
+        _PROBES[radius] = np.array([sum(1 << b for b in combo) for bits in range(radius + 1)
+                                    for combo in combinations(range(CHUNK_BITS), bits)], dtype=np.uint16)
+    return _PROBES[radius]
+
+def _chunk(hashes, position):
+    return ((hashes >> np.uint64(position * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+class BaselineIndex:
+    # In-memory index over the baselines table of a HistoryStore. Loading reads one
+    # (id, dhash) column pair and, for large indexes, sorts four uint16 arrays.
+    # Baselines added later, by this process or another, are picked up by id and land
+    # in a small unsorted tail that is scanned directly and folded into the tables
+    # once it grows.
+    def __init__(self, store):
+        self.store = store
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.indexed = 0
+        self.tables = []
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def refresh(self):
+        with self._lock:
+            last_id = int(self.ids[-1]) if len(self.ids) else 0
+            rows = self.store.baseline_hashes(last_id)
+            if rows:
+                self.ids = np.concatenate([self.ids, np.array([row[0] for row in rows], dtype=np.int64)])
+                self.hashes = np.concatenate([self.hashes, np.array([_to_unsigned(row[1]) for row in rows], dtype=np.uint64)])
+            if len(self.ids) >= SCAN_BELOW and len(self.ids) - self.indexed > max(TAIL_SIZE, self.indexed // 8):
+                self._rebuild()
+
+    def _rebuild(self):
+        # Per chunk position: entries ordered by chunk value, plus where each of the
+        # 65536 values starts in that order, so a probe is two lookups
+        orders, offsets = [], []
+        for position in range(CHUNKS):
+            chunks = _chunk(self.hashes, position)
+            orders.append(np.argsort(chunks, kind="stable"))
+            offsets.append(np.concatenate(([0], np.cumsum(np.bincount(chunks, minlength=1 << CHUNK_BITS)))))
+        self.tables = (np.concatenate(orders), np.stack(offsets))
+        self.indexed = len(self.ids)
+
+    def approve(self, image, name=None, timer=None):
+        # Stores the image as an approved baseline and makes it findable right away
+        baseline_id = self.store.add_baseline(image, _to_signed(dhash(image)), name, timer)
+        self.refresh()
+        return baseline_id
+
+    def nearest(self, query_hash, k=3, max_distance=MAX_DISTANCE):
+        # Up to k baselines within max_distance bits of query_hash, closest first
+        self.refresh()
+        with self._lock:
+            ids, hashes, indexed, tables = self.ids, self.hashes, self.indexed, self.tables
+        if len(ids) < SCAN_BELOW or not tables:
+            positions = np.arange(len(ids))
+        else:
+            positions = np.concatenate([self._probe(tables, query_hash, max_distance), np.arange(indexed, len(ids))])
+        distances = hamming(hashes[positions], query_hash)
+        keep = distances <= max_distance
+        positions, distances = positions[keep], distances[keep]
+        best = np.argsort(distances, kind="stable")[:k]
+        entries = {entry["id"]: entry for entry in self.store.baselines([int(ids[p]) for p in positions[best]])}
+        results = []
+        for p, distance in zip(positions[best], distances[best]):
+            entry = entries.get(int(ids[p]))
+            if entry:
+                entry["dhash"] = _to_unsigned(entry["dhash"])
+                results.append(dict(entry, distance=int(distance)))
+        return results
+
+    def _probe(self, tables, query_hash, max_distance):
+        # Positions of every indexed hash that can be within max_distance, and a few more
+        orders, offsets = tables
+        indexed = len(orders) // CHUNKS
+        query = np.array([query_hash], dtype=np.uint64)
+        values = np.stack([_chunk(query, position)[0] ^ _probes(max_distance // CHUNKS) for position in range(CHUNKS)])
+        rows = np.arange(CHUNKS)[:, None]
+        starts = (offsets[rows, values] + rows * indexed).ravel()
+        lengths = (offsets[rows, values.astype(np.int64) + 1] + rows * indexed).ravel() - starts
+        # All the [start, start + length) ranges of orders in one gather
+        total = int(lengths.sum())
+        steps = np.ones(total, dtype=np.int64)
+        nonempty = lengths > 0
+        heads = np.cumsum(lengths[nonempty]) - lengths[nonempty]
+        steps[heads] = starts[nonempty] - np.concatenate(([0], (starts + lengths)[nonempty][:-1] - 1))
+        return np.unique(orders[np.cumsum(steps)]) if total else np.zeros(0, dtype=np.int64)
+
+# ========== Entry Point ==========
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add approved baselines to the perceptual-hash index and look them up.")
+    parser.add_argument("--store", default=None, help="History directory (default: $VRA_HISTORY_DIR or ~/.cache/...)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = commands.add_parser("add", help="Approve images as baselines")
+    add_parser.add_argument("images", nargs="+")
+    add_parser.add_argument("--name", help="Name for every image (default: the file path)")
+
+    query_parser = commands.add_parser("query", help="Print the nearest baselines of each image as JSON lines")
+    query_parser.add_argument("images", nargs="+")
+    query_parser.add_argument("-k", type=int, default=3, help="Baselines per image")
+    query_parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help="Largest Hamming distance (of 64 bits) to report")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.store) if args.store else HistoryStore()
+    index = BaselineIndex(store)
+    if args.command == "add":
+        for path in args.images:
+            with Image.open(path) as image:
+                image.load()
+            baseline_id = index.approve(image, args.name or os.path.normpath(path))
+            print(json.dumps({"path": path, "id": baseline_id}))
+    else:
+        for path in args.images:
+            matches = index.nearest(dhash(path), args.k, args.max_distance)
+            print(json.dumps({"path": path, "matches": matches}))
+    print(f"{len(index)} baselines indexed", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
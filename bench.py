@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import engine
+from timing import StageTimer, peak_memory
+
+SIZES = {
+    "720p": (1280, 720),
+    "4k": (3840, 2160),
+    "tall": (1280, 12000)
+}
+SCENARIOS = ("identical", "text_edit", "noise", "shifted")
+MODES = {
+    "normal": engine.compare_images,
+    "coarse_to_fine": engine.compare_images_coarse_to_fine,
+    "tiled": engine.compare_images_tiled,
+    "ssim": lambda baseline, new, tolerance, **options: engine.compare_images_ssim(baseline, new, **options)
+}
+WORDS = ("account", "settings", "billing", "overview", "report", "team", "usage", "search",
+         "profile", "export", "invoice", "project", "status", "latest", "members", "upgrade")
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# ========== Synthetic Corpus ==========
+# Pages are drawn from a seeded generator, so every run and machine benchmarks the
+# same pixels: a header bar, then rows of text lines, cards and buttons.
+def make_page(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 248, dtype=np.uint8)
+    cv2.rectangle(page, (0, 0), (width, 64), (33, 37, 41), -1)
+    cv2.putText(page, "Dashboard", (24, 42), FONT, 0.9, (255, 255, 255), 2, cv2.LINE_AA)
+    margin = max(16, width // 12)
+    lines = []
+    y = 100
+    while y < height - 40:
+        kind = rng.choice(("text", "card", "button"), p=(0.65, 0.2, 0.15))
+        if kind == "text":
+            text = " ".join(rng.choice(WORDS, size=int(rng.integers(3, 12))))
+            cv2.putText(page, text, (margin, y), FONT, 0.6, (52, 58, 64), 1, cv2.LINE_AA)
+            lines.append(((margin, y), text))
+            y += 28
+        elif kind == "card":
+            bottom = min(y + int(rng.integers(80, 200)), height - 20)
+            cv2.rectangle(page, (margin, y), (width - margin, bottom), (255, 255, 255), -1)
+            cv2.rectangle(page, (margin, y), (width - margin, bottom), (222, 226, 230), 1)
+            y = bottom + 32
+        else:
+            color = tuple(int(c) for c in rng.integers(0, 200, 3))
+            cv2.rectangle(page, (margin, y - 18), (margin + 140, y + 14), color, -1)
+            cv2.putText(page, str(rng.choice(WORDS)), (margin + 16, y + 4), FONT, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+            y += 52
+    return page, lines
+
+def edit_text(page, lines, seed=0, count=3):
+    # Sparse edit: a handful of words change, everything else is pixel-identical
+    rng = np.random.default_rng(seed + 1)
+    edited = page.copy()
+    for index in rng.choice(len(lines), size=min(count, len(lines)), replace=False):
+        (x, y), text = lines[index]
+        (w, h), baseline = cv2.getTextSize(text, FONT, 0.6, 1)
+        cv2.rectangle(edited, (x, y - h - 2), (x + w, y + baseline), (248, 248, 248), -1)
+        words = text.split()
+        words[int(rng.integers(len(words)))] = str(rng.choice(WORDS)).upper()
+        cv2.putText(edited, " ".join(words), (x, y), FONT, 0.6, (52, 58, 64), 1, cv2.LINE_AA)
+    return edited
+
+def add_noise(page, seed=0, sigma=6):
+    # Dense noise: every pixel moves a little, like re-encoding or sub-pixel rendering
+    rng = np.random.default_rng(seed + 2)
+    noise = rng.normal(0, sigma, page.shape)
+    return np.clip(page + noise, 0, 255).astype(np.uint8)
+
+def insert_banner(page, at=64, rows=96):
+    # Shifted layout: a banner pushes everything below it down, so the page grows
+    banner = np.empty((rows, page.shape[1], 3), dtype=np.uint8)
+    banner[:] = (255, 243, 205)
+    cv2.putText(banner, "We have updated our terms of service", (24, rows // 2 + 8), FONT, 0.7, (102, 77, 3), 2, cv2.LINE_AA)
+    return np.concatenate([page[:at], banner, page[at:]])
+
+def encode(array):
+    # Pairs are benchmarked from PNG bytes so decoding is part of the measured pipeline
+    ok, data = cv2.imencode(".png", cv2.cvtColor(array, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise RuntimeError("PNG encoding failed")
+    return data.tobytes()
+
+def make_pairs(size, scenarios=SCENARIOS, seed=0):
+    width, height = SIZES[size]
+    page, lines = make_page(width, height, seed)
+    builders = {
+        "identical": lambda: page,
+        "text_edit": lambda: edit_text(page, lines, seed),
+        "noise": lambda: add_noise(page, seed),
+        "shifted": lambda: insert_banner(page)
+    }
+    baseline = encode(page)
+    for scenario in scenarios:
+        yield scenario, baseline, encode(builders[scenario]())
+
+# ========== Running ==========
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+def run_case(baseline, new, mode, tolerance=50, repeat=3):
+    # Latency is the wall-clock time of the whole call; the stages only cover the timed
+    # parts of it and are kept as a breakdown
+    totals, stages, result = [], {}, None
+    for i in range(repeat):
+        timer = StageTimer()
+        if i == 0:
+            # Peak memory is taken on the first run only; later runs reuse warmed allocators
+            with peak_memory() as usage:
+                start = time.perf_counter()
+                result = MODES[mode](baseline, new, tolerance, draw=False, timer=timer)
+                totals.append((time.perf_counter() - start) * 1000)
+        else:
+            start = time.perf_counter()
+            result = MODES[mode](baseline, new, tolerance, draw=False, timer=timer)
+            totals.append((time.perf_counter() - start) * 1000)
+        record = timer.record()
+        for stage, ms in record["stages"].items():
+            stages.setdefault(stage, []).append(ms)
+    total = median(totals)
+    return {
+        "median_ms": round(total, 2),
+        "max_ms": round(max(totals), 2),
+        "pairs_per_second": round(1000 / total, 2) if total > 0 else None,
+        "peak_mb": usage["peak_mb"],
+        "stages": {stage: round(median(values), 2) for stage, values in stages.items()},
+        "diff_percent": result["diff_percent"]
+    }
+
+def run(sizes, scenarios, modes, tolerance=50, repeat=3, seed=0, out=None):
+    results = []
+    for size in sizes:
+        width, height = SIZES[size]
+        for scenario, baseline, new in make_pairs(size, scenarios, seed):
+            for mode in modes:
+                case = {"case": f"{size}/{scenario}/{mode}", "size": size, "scenario": scenario, "mode": mode,
+                        "width": width, "height": height}
+                case.update(run_case(baseline, new, mode, tolerance, repeat))
+                case["megapixels_per_second"] = round(width * height / 1e6 * case["pairs_per_second"], 2)
+                results.append(case)
+                if out:
+                    out.write(f"{case['case']:<32} {case['median_ms']:>10.1f} ms {case['peak_mb'] or 0:>8.1f} MB "
+                              f"{case['diff_percent']:>7.2f}%\n")
+                    out.flush()
+    return {"meta": environment(tolerance, repeat, seed), "results": results}
+
+def environment(tolerance, repeat, seed):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "tolerance": tolerance,
+        "repeat": repeat,
+        "seed": seed
+    }
+
+# ========== Regression Check ==========
+def compare_runs(baseline_run, current_run, threshold=10.0, min_ms=2.0):
+    # A case regresses when it is more than threshold % slower (and at least min_ms,
+    # so tiny cases don't flap on timer noise) or uses more than threshold % more memory
+    before = {r["case"]: r for r in baseline_run["results"]}
+    rows = []
+    for current in current_run["results"]:
+        previous = before.get(current["case"])
+        if not previous:
+            continue
+        time_change = _change(previous["median_ms"], current["median_ms"])
+        memory_change = _change(previous["peak_mb"], current["peak_mb"])
+        slower = time_change is not None and time_change > threshold and current["median_ms"] - previous["median_ms"] > min_ms
+        heavier = memory_change is not None and memory_change > threshold and current["peak_mb"] - previous["peak_mb"] > 1
+        rows.append({
+            "case": current["case"],
+            "before_ms": previous["median_ms"],
+            "after_ms": current["median_ms"],
+            "time_change": time_change,
+            "before_mb": previous["peak_mb"],
+            "after_mb": current["peak_mb"],
+            "memory_change": memory_change,
+            "regression": slower or heavier
+        })
+    return rows
+
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+def print_comparison(rows, out=sys.stdout):
+    out.write(f"{'case':<32} {'before':>10} {'after':>10} {'time':>8} {'memory':>8}\n")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        out.write(f"{row['case']:<32} {row['before_ms']:>8.1f}ms {row['after_ms']:>8.1f}ms "
+                  f"{_format_change(row['time_change']):>8} {_format_change(row['memory_change']):>8}{flag}\n")
+
+def _format_change(change):
+    return "n/a" if change is None else f"{change:+.1f}%"
+
+# ========== Entry Point ==========
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the comparison engine on synthetic screenshot pairs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark and save the results as JSON")
+    run_parser.add_argument("--sizes", default=",".join(SIZES), help=f"Comma-separated subset of {', '.join(SIZES)}")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    run_parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated subset of {', '.join(MODES)}")
+    run_parser.add_argument("--tolerance", type=int, default=50)
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported")
+    run_parser.add_argument("--seed", type=int, default=0, help="Corpus seed; keep it fixed to compare runs")
+    run_parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("baseline", help="Results JSON of the reference run")
+    compare_parser.add_argument("current", help="Results JSON of the run to check")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown / memory growth in %%")
+    compare_parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline_run = json.load(f)
+        with open(args.current) as f:
+            current_run = json.load(f)
+        rows = compare_runs(baseline_run, current_run, args.threshold, args.min_ms)
+        print_comparison(rows)
+        regressions = sum(row["regression"] for row in rows)
+        print(f"{regressions} regression(s) in {len(rows)} cases", file=sys.stderr)
+        return 1 if regressions else 0
+
+    for name, value, known in (("size", args.sizes, SIZES), ("scenario", args.scenarios, SCENARIOS), ("mode", args.modes, MODES)):
+        unknown = [v for v in value.split(",") if v not in known]
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(unknown)}")
+    report = run(args.sizes.split(","), args.scenarios.split(","), args.modes.split(","),
+                 args.tolerance, args.repeat, args.seed, out=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
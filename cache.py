@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import ingest
+import preview
+
+CACHE_MB = int(os.environ.get("VRA_CACHE_MB", "512"))
+PREVIEW_SIDE = preview.SCREEN_SIDE
+
+# ========== Keys ==========
+def bytes_key(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def image_key(image):
+    # Hash of the RGB pixels the engine compares, not of the file or the PIL mode, so the
+    # same picture uploaded, re-saved, captured or read back from history gets one key
+    array = ingest.to_rgb(image)
+    digest = hashlib.blake2b(f"{array.shape[1]}x{array.shape[0]}:".encode(), digest_size=16)
+    digest.update(array.data)
+    return digest.hexdigest()
+
+def params_key(*parts):
+    return bytes_key(repr(parts).encode())
+
+# ========== Sizing ==========
+def estimate_bytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.size[0] * value.size[1] * len(value.getbands())
+    if isinstance(value, dict):
+        return sum(estimate_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+# ========== LRU Cache ==========
+class LRUCache:
+    # Least-recently-used eviction bounded by the estimated size of the values, not
+    # their count, so a few full-page screenshots can't crowd out the process.
+    def __init__(self, max_bytes=CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key][0]
+
+    def put(self, key, value):
+        size = estimate_bytes(value)
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.current_bytes -= evicted
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+# ========== Memoized Helpers ==========
+def decode_image(cache, data):
+    # Decoded uploads and their content key, memoized by the file bytes and shared by
+    # every rerun and session. The RGB array is decoded by OpenCV and kept under
+    # ("rgb", key), so comparisons start from it instead of converting the PIL image.
+    def decode():
+        array = ingest.to_rgb(data)
+        key = image_key(array)
+        cache.put(("rgb", key), array)
+        return Image.fromarray(array), key
+    return cache.get_or_compute(("decode", bytes_key(data)), decode)
+
+def decode_preview(cache, data, key=None, max_side=PREVIEW_SIDE):
+    # Upload previews only need screen resolution; JPEGs are decoded straight at 1/2-1/8 scale
+    def decode():
+        with Image.open(BytesIO(data)) as image:
+            size = image.size
+        return ingest.to_rgb(data, ingest.preview_reduce(size, max_side))
+    return cache.get_or_compute(("preview", key or bytes_key(data), max_side), decode)
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("navigate", "settle", "screenshot")
+
+# ========== Browser Pool ==========
+class BrowserPool:
+    # One long-lived Chromium with a fixed set of reusable contexts. The number of
+    # contexts is the concurrency limit: a capture waits until one is free.
+    def __init__(self, size=4, timeout=30.0):
+        self.size = size
+        self.timeout = timeout
+        self._playwright = None
+        self._browser = None
+        self._contexts = None
+
+    async def start(self):
+        # Playwright is imported here so browser provisioning and the app's first
+        # render don't pay for it
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._contexts = asyncio.Queue()
+        for _ in range(self.size):
+            self._contexts.put_nowait(await self._browser.new_context())
+        return self
+
+    async def close(self):
+        if self._browser:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def capture(self, url, width=1280, height=720, full_page=False, timeout=None):
+        # The timeout covers the whole capture: each step gets whatever is left of it
+        timeout = timeout or self.timeout
+        deadline = time.perf_counter() + timeout
+        record = {"url": url, "width": width, "height": height, "full_page": full_page,
+                  "png": None, "timings": {}, "error": None}
+        context = await self._contexts.get()
+        page = None
+        try:
+            page = await context.new_page()
+            await page.set_viewport_size({"width": width, "height": height})
+            start = time.perf_counter()
+            await page.goto(url, wait_until="load", timeout=_remaining_ms(deadline, timeout))
+            record["timings"]["navigate"] = _elapsed_ms(start)
+            start = time.perf_counter()
+            await page.wait_for_load_state("networkidle", timeout=_remaining_ms(deadline, timeout))
+            record["timings"]["settle"] = _elapsed_ms(start)
+            start = time.perf_counter()
+            record["png"] = await page.screenshot(full_page=full_page, timeout=_remaining_ms(deadline, timeout))
+            record["timings"]["screenshot"] = _elapsed_ms(start)
+        except Exception as e:
+            record["error"] = str(e)
+        finally:
+            self._contexts.put_nowait(await self._recycle(context))
+        return record
+
+    async def _recycle(self, context):
+        # A used context still holds the page's localStorage, sessionStorage, IndexedDB,
+        # service workers and HTTP cache, any of which can change the next screenshot
+        # (a dismissed cookie banner, say), so it is swapped for a fresh one. Only the
+        # browser launch is expensive; a new context takes milliseconds.
+        try:
+            await context.close()
+            return await self._browser.new_context()
+        except Exception:
+            # The browser is gone; handing the slot back lets the next capture report
+            # that instead of waiting for a context forever
+            return context
+
+    async def capture_matrix(self, urls, viewports, full_page=False, timeout=None):
+        # Yields records as they finish; concurrency is bounded by the context pool
+        jobs = [self.capture(url, width, height, full_page, timeout)
+                for url in urls for width, height in viewports]
+        for job in asyncio.as_completed(jobs):
+            yield await job
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def _remaining_ms(deadline, timeout):
+    # Playwright treats a timeout of 0 as none at all, so an exhausted budget fails here
+    left = deadline - time.perf_counter()
+    if left <= 0:
+        raise TimeoutError(f"Capture timed out after {timeout} s")
+    return left * 1000
+
+# ========== Browser Provisioning ==========
+def browsers_installed():
+    # Playwright keeps its browsers under PLAYWRIGHT_BROWSERS_PATH or ~/.cache/ms-playwright
+    path = os.environ.get("PLAYWRIGHT_BROWSERS_PATH") or os.path.expanduser("~/.cache/ms-playwright")
+    return os.path.isdir(path) and bool(os.listdir(path))
+
+class BrowserSetup:
+    # Runs `playwright install chromium` on a daemon thread, only when no browsers are
+    # installed, so callers can keep rendering and check `state` instead of blocking
+    def __init__(self):
+        self.state = "checking"
+        self.error = None
+        self.seconds = None
+        self._done = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            if not browsers_installed():
+                self.state = "installing"
+                subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], check=True, capture_output=True)
+            self.state = "ready"
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", None)
+            self.error = stderr.decode(errors="replace").strip() if stderr else str(e)
+            self.state = "failed"
+        finally:
+            self.seconds = round(time.perf_counter() - start, 2)
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+# ========== Sync Bridge ==========
+class BackgroundBrowserPool:
+    # Keeps a BrowserPool alive on its own event loop thread so synchronous callers
+    # (Streamlit reruns, the CLI) can share one browser. The browser starts on first use.
+    def __init__(self, size=2, timeout=30.0):
+        self.pool = BrowserPool(size, timeout)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._started:
+                self._run(self.pool.start())
+                self._started = True
+
+    def capture(self, url, width=1280, height=720, full_page=False, timeout=None):
+        self._ensure_started()
+        return self._run(self.pool.capture(url, width, height, full_page, timeout))
+
+    def close(self):
+        with self._lock:
+            if self._started:
+                self._run(self.pool.close())
+                self._started = False
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+# ========== Reporting ==========
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(records, elapsed):
+    ok = [r for r in records if not r["error"]]
+    stages = {}
+    for stage in STAGES:
+        values = [r["timings"][stage] for r in ok if stage in r["timings"]]
+        stages[stage] = {
+            "mean_ms": round(sum(values) / len(values), 2) if values else None,
+            "p50_ms": percentile(values, 0.5),
+            "p95_ms": percentile(values, 0.95)
+        }
+    return {
+        "captures": len(records),
+        "errors": len(records) - len(ok),
+        "seconds": round(elapsed, 3),
+        "captures_per_second": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": stages
+    }
+
+# ========== Local Fixture Server ==========
+@contextmanager
+def serve_directory(directory, port=0):
+    # Serves fixture pages on localhost so captures can be tested without the network
+    handler = partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+# ========== Entry Point ==========
+def parse_viewport(value):
+    match = re.fullmatch(r"(\d+)x(\d+)", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"viewport must look like 1280x720, got {value!r}")
+    return int(match.group(1)), int(match.group(2))
+
+def slugify(url):
+    return re.sub(r"[^A-Za-z0-9]+", "_", re.sub(r"^https?://", "", url)).strip("_") or "page"
+
+async def run_captures(urls, viewports, concurrency, timeout, full_page, out_dir, names, out):
+    records = []
+    start = time.perf_counter()
+    async with BrowserPool(concurrency, timeout) as pool:
+        async for record in pool.capture_matrix(urls, viewports, full_page, timeout):
+            png = record.pop("png")
+            if png is not None and out_dir:
+                # <out>/<page>/<W>x<H>.png lines up with cli.py's relative-path pair matching
+                path = os.path.join(out_dir, slugify(names.get(record["url"], record["url"])), f"{record['width']}x{record['height']}.png")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(png)
+                record["path"] = path
+            records.append(record)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    return summarize(records, time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture a matrix of URLs x viewports with a shared browser pool.")
+    parser.add_argument("urls", nargs="+", help="Pages to capture (relative paths when --serve is used)")
+    parser.add_argument("--viewport", type=parse_viewport, action="append", help="WIDTHxHEIGHT, repeatable (default 1280x720)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pages captured at once")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-page timeout in seconds")
+    parser.add_argument("--full-page", action="store_true", help="Capture the whole scrollable page")
+    parser.add_argument("--out-dir", help="Save screenshots as <out-dir>/<page>/<W>x<H>.png")
+    parser.add_argument("--serve", metavar="DIR", help="Serve DIR on localhost and resolve URLs against it")
+    args = parser.parse_args(argv)
+    viewports = args.viewport or [(1280, 720)]
+
+    with serve_directory(args.serve) if args.serve else nullcontext() as base_url:
+        names = {}
+        for url in args.urls:
+            names[url if not base_url or re.match(r"https?://", url) else base_url + url.lstrip("/")] = url
+        summary = asyncio.run(run_captures(list(names), viewports, args.concurrency, args.timeout,
+                                           args.full_page, args.out_dir, names, sys.stdout))
+
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from xml.sax.saxutils import escape, quoteattr
+
+import engine
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# ========== Pair Discovery ==========
+def list_images(root):
+    found = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                found[os.path.relpath(path, root).replace(os.sep, "/")] = path
+    return found
+
+def find_pairs(baseline_dir, new_dir):
+    baselines = list_images(baseline_dir)
+    news = list_images(new_dir)
+    pairs = [{"name": name, "baseline": baselines[name], "new": news[name]}
+             for name in sorted(baselines) if name in news]
+    missing = [{"name": name, "baseline": baselines[name]} for name in sorted(baselines) if name not in news]
+    return pairs, missing
+
+def read_manifest(path):
+    # JSON lines: {"baseline": ..., "new": ..., "name": optional, "ignore"/"include": optional
+    # lists of [x, y, w, h] baseline rectangles}, paths relative to the manifest
+    base_dir = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "baseline" not in entry or "new" not in entry:
+                raise ValueError(f"{path}:{line_no}: manifest entries need 'baseline' and 'new'")
+            pairs.append({
+                "name": entry.get("name") or os.path.basename(entry["new"]),
+                "baseline": os.path.join(base_dir, entry["baseline"]),
+                "new": os.path.join(base_dir, entry["new"]),
+                "ignore": entry.get("ignore"),
+                "include": entry.get("include")
+            })
+    return pairs
+
+# ========== Batch Runner ==========
+def run_batch(pairs, tolerance=50, pass_threshold=10, fail_threshold=70, workers=None, **options):
+    # Yields records as workers finish them, in completion order.
+    # Extra options (tiled, max_band_mb, early_exit, coarse_to_fine, align, metric, ssim_threshold, block)
+    # are passed through to engine.compare_pair.
+    tasks = [dict(pair, tolerance=tolerance, pass_threshold=pass_threshold, fail_threshold=fail_threshold, **options)
+             for pair in pairs]
+    if not tasks:
+        return
+    workers = min(workers or engine.default_workers(), len(tasks))
+    if workers == 1:
+        engine.init_worker()
+        for task in tasks:
+            yield engine.compare_pair(task)
+        return
+    chunksize = max(1, len(tasks) // (workers * 8))
+    with Pool(workers, initializer=engine.init_worker) as pool:
+        for record in pool.imap_unordered(engine.compare_pair, tasks, chunksize):
+            yield record
+
+# ========== Output Writers ==========
+class JsonLinesWriter:
+    def __init__(self, out):
+        self.out = out
+
+    def start(self):
+        pass
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+
+    def finish(self, summary):
+        pass
+
+class JUnitWriter:
+    # Test cases are streamed as they complete; CI parsers count them from the elements
+    def __init__(self, out):
+        self.out = out
+
+    def start(self):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.out.write('<testsuite name="visual-regression">\n')
+        self.out.flush()
+
+    def write(self, record):
+        seconds = record["duration_ms"] / 1000
+        self.out.write(f'  <testcase classname="visual-regression" name={quoteattr(record["name"])} time="{seconds:.3f}">\n')
+        if record["status"] == "error":
+            self.out.write(f'    <error message={quoteattr(record.get("error", ""))}/>\n')
+        elif record["status"] == "fail":
+            message = f'{record["diff_percent"]}% of pixels changed'
+            details = json.dumps(record["regions"])
+            self.out.write(f'    <failure message={quoteattr(message)}>{escape(details)}</failure>\n')
+        self.out.write(f'    <system-out>{escape(json.dumps(record))}</system-out>\n')
+        self.out.write('  </testcase>\n')
+        self.out.flush()
+
+    def finish(self, summary):
+        self.out.write(f'  <system-out>{escape(json.dumps(summary))}</system-out>\n')
+        self.out.write('</testsuite>\n')
+        self.out.flush()
+
+WRITERS = {"jsonl": JsonLinesWriter, "junit": JUnitWriter}
+
+# ========== Entry Point ==========
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare baseline and new screenshots without the Streamlit UI.")
+    parser.add_argument("baseline_dir", nargs="?", help="Directory of baseline images")
+    parser.add_argument("new_dir", nargs="?", help="Directory of new images, matched by relative path")
+    parser.add_argument("--manifest", help="JSON lines file of {\"baseline\", \"new\", \"name\"} pairs")
+    parser.add_argument("--tolerance", type=int, default=50, help="Gray difference (0-255) a pixel must exceed to count")
+    parser.add_argument("--pass-threshold", type=float, default=10, help="Pass at or below this difference %%")
+    parser.add_argument("--fail-threshold", type=float, default=70, help="Fail at or above this difference %%")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--tiled", action="store_true", help="Compare in horizontal bands to bound memory on tall screenshots")
+    parser.add_argument("--max-band-mb", type=int, default=64, help="Working memory per band in tiled mode")
+    parser.add_argument("--early-exit", action="store_true", help="In tiled mode, stop a pair once it passes the fail threshold")
+    parser.add_argument("--coarse-to-fine", action="store_true", help="Only diff tiles that changed; fastest on mostly identical pairs")
+    parser.add_argument("--no-align", dest="align", action="store_false", help="Compare rows in place instead of matching shifted rows first")
+    parser.add_argument("--metric", choices=("pixel", "ssim"), default="pixel",
+                        help="pixel: gray difference above --tolerance; ssim: block-wise structural similarity")
+    parser.add_argument("--ssim-threshold", type=float, default=engine.SSIM_THRESHOLD,
+                        help="In ssim mode, blocks scoring below this count as changed")
+    parser.add_argument("--block", type=int, default=engine.SSIM_BLOCK, help="SSIM block size in pixels")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--output", help="Write results here instead of stdout")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        pairs, missing = read_manifest(args.manifest), []
+    elif args.baseline_dir and args.new_dir:
+        pairs, missing = find_pairs(args.baseline_dir, args.new_dir)
+    else:
+        parser.error("give either BASELINE_DIR NEW_DIR or --manifest")
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    writer = WRITERS[args.format](out)
+    stage_ms = {}
+    counts = {"pass": 0, "minor": 0, "moderate": 0, "critical": 0, "fail": 0, "error": 0}
+    start = time.perf_counter()
+    try:
+        writer.start()
+        for pair in missing:
+            record = {"name": pair["name"], "baseline": pair["baseline"], "new": None, "diff_percent": None,
+                      "status": "error", "regions": [], "error": "no matching new image", "duration_ms": 0.0}
+            counts["error"] += 1
+            writer.write(record)
+        records = run_batch(pairs, args.tolerance, args.pass_threshold, args.fail_threshold, args.workers,
+                            tiled=args.tiled, max_band_mb=args.max_band_mb, early_exit=args.early_exit,
+                            coarse_to_fine=args.coarse_to_fine, align=args.align, metric=args.metric,
+                            ssim_threshold=args.ssim_threshold, block=args.block)
+        for record in records:
+            counts[record["status"]] += 1
+            for stage, ms in record.get("timings", {}).items():
+                stage_ms[stage] = stage_ms.get(stage, 0.0) + ms
+            writer.write(record)
+        elapsed = time.perf_counter() - start
+        summary = {
+            "pairs": len(pairs),
+            "seconds": round(elapsed, 3),
+            "pairs_per_second": round(len(pairs) / elapsed, 2) if elapsed > 0 else 0.0,
+            "counts": counts,
+            "stage_ms": {stage: round(ms, 2) for stage, ms in stage_ms.items()}
+        }
+        writer.finish(summary)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"{summary['pairs']} pairs in {summary['seconds']}s ({summary['pairs_per_second']} pairs/s), "
+          f"{counts['fail']} failed, {counts['error']} errors", file=sys.stderr)
+    return 1 if counts["fail"] or counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
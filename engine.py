@@ -0,0 +1,820 @@
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import align as row_align
+import ingest
+import ssim
+from timing import StageTimer
+
+HIGHLIGHT_COLOR = (255, 71, 87)
+INSERT_COLOR = (0, 169, 255)
+# Change regions: groups with fewer changed pixels are noise, pixels this close are one region,
+# and only the largest groups are reported so the output stays small on noisy pairs
+MIN_REGION_AREA = 8
+MERGE_DISTANCE = 8
+MAX_REGIONS = 500
+# SSIM mode: blocks scoring below the threshold count as changed
+SSIM_THRESHOLD = 0.75
+SSIM_BLOCK = 16
+
+# ========== Loading ==========
+def load_array(source, timer=None):
+    # Single owned, contiguous RGB array. Encoded files and bytes are decoded by OpenCV
+    # straight into it; PIL images and arrays are only converted if they aren't RGB yet.
+    timer = timer or StageTimer()
+    if isinstance(source, (Image.Image, np.ndarray)):
+        with timer.stage("rgb"):
+            array = ingest.to_rgb(source)
+            # Overlays are drawn into the baseline array, so never hand back the caller's
+            return array.copy() if array is source else array
+    with timer.stage("decode"):
+        return ingest.to_rgb(source)
+
+def resize_array(array, size):
+    # Area averaging when shrinking, Lanczos when growing
+    shrinking = size[0] * size[1] < array.shape[1] * array.shape[0]
+    return cv2.resize(array, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4)
+
+def load_pair(baseline_img, new_img, timer=None, align=False):
+    # Both images as owned RGB arrays plus any warnings. The new image is resized to the
+    # baseline's size, except that with align=True a height-only change is kept as is
+    # so rows can be matched instead of stretched.
+    timer = timer or StageTimer()
+    baseline_np = load_array(baseline_img, timer)
+    new_np = load_array(new_img, timer)
+    warnings = []
+
+    size = (baseline_np.shape[1], baseline_np.shape[0])
+    new_size = (new_np.shape[1], new_np.shape[0])
+    if new_size != size and align and new_size[0] == size[0]:
+        warnings.append(f"Image heights differ: Baseline {size}, New {new_size}. Aligning rows instead of resizing.")
+    elif new_size != size:
+        warnings.append(f"Image sizes differ: Baseline {size}, New {new_size}. Resizing new image to match baseline.")
+        with timer.stage("resize"):
+            new_np = resize_array(new_np, size)
+
+    if baseline_np.shape[1:] != new_np.shape[1:] or (not align and baseline_np.shape != new_np.shape):
+        raise ValueError(f"Shape mismatch after resize: Baseline {baseline_np.shape}, New {new_np.shape}")
+    return baseline_np, new_np, warnings
+
+# ========== Comparison ==========
+def threshold_diff(diff_np, tolerance, timer=None):
+    timer = timer or StageTimer()
+    with timer.stage("grayscale"):
+        gray_diff = cv2.cvtColor(diff_np, cv2.COLOR_RGB2GRAY)
+    with timer.stage("threshold"):
+        _, thresh = cv2.threshold(gray_diff, tolerance, 255, cv2.THRESH_BINARY)
+    return gray_diff, thresh
+
+def gray_histogram(gray_diff):
+    # bincount wins on small tiles, calcHist on anything bigger. calcHist counts in
+    # float32, exact up to 2**24 per bin, so tall images go in blocks.
+    if gray_diff.size < 1 << 16:
+        return np.bincount(gray_diff.ravel(), minlength=256).astype(np.int64)
+    rows = max(1, (1 << 24) // max(1, gray_diff.shape[1]))
+    histogram = np.zeros(256, dtype=np.int64)
+    for y in range(0, gray_diff.shape[0], rows):
+        histogram += cv2.calcHist([gray_diff[y:y + rows]], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    return histogram
+
+# ========== Change Regions ==========
+# Changed pixels are grouped by dilating the threshold mask (so pixels within
+# merge_distance of each other join), labelled once with connectedComponentsWithStats,
+# and summarized with bincounts. No per-contour Python work, however noisy the pair.
+def group_mask(thresh, merge_distance=MERGE_DISTANCE, top=None, bottom=None):
+    # Dilated mask padded by r on every side (or by top/bottom rows when given), so
+    # labelled boxes shrunk by r are exact even for regions touching the image edge
+    r = (merge_distance + 1) // 2
+    padded = cv2.copyMakeBorder(thresh, r if top is None else top, r if bottom is None else bottom, r, r,
+                                cv2.BORDER_CONSTANT, value=0)
+    if r:
+        padded = cv2.dilate(padded, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * r + 1, 2 * r + 1)))
+    return padded, r
+
+def extract_regions(thresh, gray_diff, min_area=MIN_REGION_AREA, merge_distance=MERGE_DISTANCE, max_regions=MAX_REGIONS):
+    if not cv2.countNonZero(thresh):
+        return []
+    grouped, r = group_mask(thresh, merge_distance)
+    boxes, areas, totals = [], [], []
+    for _, _, _, _, stats, run_areas, run_totals in label_runs(grouped, thresh, gray_diff, r, r):
+        boxes.append(stats[1:, :4])
+        areas.append(run_areas[1:])
+        totals.append(run_totals[1:])
+    return finish_regions(np.concatenate(boxes), np.concatenate(areas), np.concatenate(totals), r, min_area, max_regions)
+
+def label_runs(grouped, thresh, gray_diff, r, top):
+    # No group crosses an empty row, so each run of non-empty rows is labelled on its
+    # own, cropped to its columns: sparse changes never pay for labelling the whole mask.
+    # Row y / column x of thresh and gray_diff sit at row y + top / column x + r of grouped.
+    height, width = thresh.shape
+    for y0, y1 in _row_runs(grouped):
+        x0, _, run_width, _ = cv2.boundingRect(grouped[y0:y1])
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(grouped[y0:y1, x0:x0 + run_width], connectivity=8)
+        iy0, iy1 = max(0, y0 - top), min(height, y1 - top)
+        ix0, ix1 = max(0, x0 - r), min(width, x0 + run_width - r)
+        areas, totals = _label_sums(labels[iy0 + top - y0:iy1 + top - y0, ix0 + r - x0:ix1 + r - x0],
+                                    thresh[iy0:iy1, ix0:ix1], gray_diff[iy0:iy1, ix0:ix1], count)
+        stats[:, 0] += x0
+        stats[:, 1] += y0
+        yield y0, y1, x0, labels, stats, areas, totals
+
+def _row_runs(mask):
+    rows = mask.max(axis=1) > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], rows, [False])).astype(np.int8)))
+    return zip(edges[::2], edges[1::2])
+
+def _label_sums(labels, thresh, gray_diff, count):
+    # Changed-pixel count and gray-diff sum per label
+    changed = thresh > 0
+    owners = labels[changed]
+    return (np.bincount(owners, minlength=count),
+            np.bincount(owners, weights=gray_diff[changed], minlength=count))
+
+def finish_regions(boxes, areas, totals, r, min_area=MIN_REGION_AREA, max_regions=MAX_REGIONS):
+    # boxes are (x, y, w, h) of the dilated groups in padded coordinates; shrinking
+    # them by r gives the tight box of the changed pixels in image coordinates
+    keep = np.flatnonzero(areas >= max(1, min_area))
+    keep = keep[np.argsort(-areas[keep], kind="stable")][:max_regions]
+    regions = [{
+        'x': int(boxes[i][0]),
+        'y': int(boxes[i][1]),
+        'w': int(boxes[i][2]) - 2 * r,
+        'h': int(boxes[i][3]) - 2 * r,
+        'area': int(areas[i]),
+        'mean_intensity': round(float(totals[i]) / int(areas[i]), 1)
+    } for i in keep]
+    regions.sort(key=lambda region: (region['y'], region['x']))
+    return regions
+
+def compare_images(baseline_img, new_img, tolerance=50, draw=True, align=True, ignore=None, include=None, timer=None):
+    # Headless comparison core: raises on bad input and collects warnings
+    # instead of reporting through Streamlit, so the CLI and the UI share it.
+    timer = timer or StageTimer()
+    baseline_np, new_np, warnings = load_pair(baseline_img, new_img, timer, align)
+    return compare_arrays(baseline_np, new_np, warnings, tolerance, draw, align,
+                          ignore=ignore, include=include, timer=timer)
+
+def draw_regions(image_np, regions, bands=()):
+    # One polylines call for every box, however many regions there are
+    boxes = [np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.int32)
+             for x, y, w, h in ((r['x'], r['y'], r['w'], r['h']) for r in regions)]
+    if boxes:
+        cv2.polylines(image_np, boxes, True, HIGHLIGHT_COLOR, 2)
+    # Rows that only exist in the new image have no baseline pixels to box, so mark where they go in
+    for band in bands:
+        if band['type'] == 'inserted':
+            y = min(band['baseline_row'], image_np.shape[0] - 1)
+            cv2.line(image_np, (0, y), (image_np.shape[1] - 1, y), INSERT_COLOR, 3)
+    return Image.fromarray(image_np)
+
+# ========== Tolerance Re-evaluation ==========
+# The gray-diff histogram of a pair answers "how many pixels exceed tolerance t"
+# for every t, so moving the tolerance never needs another absdiff.
+def tolerance_sweep(histogram):
+    total = int(histogram.sum())
+    if total == 0:
+        return np.zeros(256)
+    return (total - np.cumsum(histogram)) / total * 100
+
+def diff_percent_at(histogram, tolerance):
+    return round(float(tolerance_sweep(histogram)[int(tolerance)]), 2)
+
+def regions_at(gray_diff, tolerance, window=None):
+    # window is the (y0, y1, x0, x1) box holding every compared pixel; nothing outside
+    # it can have changed, so only that part is thresholded and scanned
+    y0, y1, x0, x1 = window or (0, gray_diff.shape[0], 0, gray_diff.shape[1])
+    gray_diff = gray_diff[y0:y1, x0:x1]
+    _, thresh = cv2.threshold(gray_diff, tolerance, 255, cv2.THRESH_BINARY)
+    return offset_regions(extract_regions(thresh, gray_diff), x0, y0)
+
+def offset_regions(regions, x0, y0):
+    for region in regions:
+        region['x'] += x0
+        region['y'] += y0
+    return regions
+
+def changed_window(boxes, rows=()):
+    # Bounding (y0, y1, x0, x1) of the diffed boxes and of any (y0, y1, x0, x1) rows
+    # marked changed without a diff, or None when nothing was compared
+    extents = [box[:4] for box in boxes] + list(rows)
+    if not extents:
+        return None
+    return (min(e[0] for e in extents), max(e[1] for e in extents),
+            min(e[2] for e in extents), max(e[3] for e in extents))
+
+def highlight_at(baseline_img, regions, bands=()):
+    return draw_regions(load_array(baseline_img), regions, bands)
+
+# ========== Coarse-to-Fine Comparison ==========
+# Screens a tile quadtree with exact equality checks and only runs the full
+# absdiff/threshold/histogram pass on leaf tiles that really differ. Unchanged
+# tiles contribute nothing above any tolerance, so the diff % and boxes are exact.
+def changed_tiles(baseline_np, new_np, tile=256, min_tile=32):
+    height, width = baseline_np.shape[:2]
+    pending = [(y, min(y + tile, height), x, min(x + tile, width))
+               for y in range(0, height, tile) for x in range(0, width, tile)]
+    changed = []
+    while pending:
+        y0, y1, x0, x1 = pending.pop()
+        if np.array_equal(baseline_np[y0:y1, x0:x1], new_np[y0:y1, x0:x1]):
+            continue
+        if y1 - y0 <= min_tile and x1 - x0 <= min_tile:
+            changed.append((y0, y1, x0, x1))
+            continue
+        ym = y0 + (y1 - y0 + 1) // 2 if y1 - y0 > min_tile else y1
+        xm = x0 + (x1 - x0 + 1) // 2 if x1 - x0 > min_tile else x1
+        for ya, yb in ((y0, ym), (ym, y1)):
+            for xa, xb in ((x0, xm), (xm, x1)):
+                if ya < yb and xa < xb:
+                    pending.append((ya, yb, xa, xb))
+    return changed
+
+def compare_images_coarse_to_fine(baseline_img, new_img, tolerance=50, draw=True, tile=256, min_tile=32, align=True,
+                                  ignore=None, include=None, timer=None):
+    timer = timer or StageTimer()
+    baseline_np, new_np, warnings = load_pair(baseline_img, new_img, timer, align)
+    return compare_arrays(baseline_np, new_np, warnings, tolerance, draw, align, tile, min_tile, ignore, include, timer)
+
+# ========== Masks ==========
+# Ignore rectangles (timestamps, ads, carousels) and include ROIs, both (x, y, w, h) in
+# baseline pixels, are turned into disjoint rectangles of pixels to check. Only those
+# sub-arrays are ever diffed, and the diff % is taken over the checked area alone.
+def checked_rects(width, height, ignore=(), include=()):
+    # Disjoint (y0, y1, x0, x1) rectangles covering include minus ignore, or the whole
+    # image when neither is given. Built per horizontal slab between rectangle edges,
+    # with slabs of identical x-intervals merged vertically.
+    include = _clip_rects(include, width, height) if include else [(0, 0, width, height)]
+    ignore = _clip_rects(ignore or (), width, height)
+    edges = sorted({0, height} | {y for _, y0, _, y1 in include + ignore for y in (y0, y1)})
+    rects, open_spans = [], {}
+    for y0, y1 in zip(edges, edges[1:]):
+        keep = _merge_intervals([(x0, x1) for x0, top, x1, bottom in include if top <= y0 and bottom >= y1])
+        drop = _merge_intervals([(x0, x1) for x0, top, x1, bottom in ignore if top <= y0 and bottom >= y1])
+        spans = set(_subtract_intervals(keep, drop))
+        for span in list(open_spans):
+            if span not in spans:
+                rects.append((open_spans.pop(span), y0, *span))
+        for span in spans:
+            open_spans.setdefault(span, y0)
+    rects.extend((start, height, *span) for span, start in open_spans.items())
+    return sorted(rects)
+
+def _clip_rects(rects, width, height):
+    clipped = []
+    for x, y, w, h in rects:
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(width, int(x + w)), min(height, int(y + h))
+        if x0 < x1 and y0 < y1:
+            clipped.append((x0, y0, x1, y1))
+    return clipped
+
+def _merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _subtract_intervals(keep, drop):
+    result = []
+    for start, end in keep:
+        for d0, d1 in drop:
+            if d1 <= start or d0 >= end:
+                continue
+            if d0 > start:
+                result.append((start, d0))
+            start = max(start, d1)
+        if start < end:
+            result.append((start, end))
+    return result
+
+def row_coverage(rects, row):
+    return sum(x1 - x0 for y0, y1, x0, x1 in rects if y0 <= row < y1)
+
+# ========== Row-Aligned Comparison ==========
+# Rows are hashed and matched first, so a banner pushing the page down shows up as
+# one inserted band instead of every row below it changing. Matched rows are checked
+# for exact equality (a hash collision can never hide a change) and only the rows
+# left over are pixel-diffed. Deleted baseline rows count as fully changed; inserted
+# rows are added to the histogram so the diff % is taken over the union of both.
+def match_rows(baseline_np, new_np, align=True, timer=None):
+    timer = timer or StageTimer()
+    if not align:
+        return [(0, baseline_np.shape[0], 0)], []
+    with timer.stage("align"):
+        opcodes = row_align.align_rows(row_align.row_hashes(baseline_np), row_align.row_hashes(new_np))
+        spans, bands = [], []
+        for tag, a0, a1, b0, b1 in opcodes:
+            if tag == "equal":
+                if not np.array_equal(baseline_np[a0:a1], new_np[b0:b1]):
+                    spans.append((a0, a1, b0))
+                continue
+            common = min(a1 - a0, b1 - b0)
+            if common:
+                spans.append((a0, a0 + common, b0))
+            if a1 - a0 > common:
+                bands.append({'type': 'deleted', 'baseline_rows': (a0 + common, a1), 'new_row': b0 + common})
+            if b1 - b0 > common:
+                bands.append({'type': 'inserted', 'new_rows': (b0 + common, b1), 'baseline_row': a0 + common})
+    return spans, bands
+
+def span_boxes(spans, rects):
+    # (y0, y1, x0, x1, new_y0) boxes to compare: matched row spans cut to the checked rectangles
+    return [(max(a0, y0), min(a1, y1), x0, x1, b0 + max(a0, y0) - a0)
+            for a0, a1, b0 in spans for y0, y1, x0, x1 in rects if max(a0, y0) < min(a1, y1)]
+
+def compare_arrays(baseline_np, new_np, warnings, tolerance=50, draw=True, align=True, tile=None, min_tile=32,
+                   ignore=None, include=None, timer=None):
+    # spans are (baseline_start, baseline_end, new_start) row runs compared pixel by pixel,
+    # cut down to the checked rectangles. With a tile size they are screened with
+    # changed_tiles first (coarse-to-fine mode).
+    timer = timer or StageTimer()
+    height, width = baseline_np.shape[:2]
+    rects = checked_rects(width, height, ignore, include)
+    # An ROI-only check of same-size images stays inside the ROIs instead of hashing every row
+    align = align and (not include or new_np.shape[0] != height)
+    spans, bands = match_rows(baseline_np, new_np, align, timer)
+
+    boxes = span_boxes(spans, rects)
+    if tile:
+        with timer.stage("screening"):
+            boxes = [(by0 + y0, by0 + y1, bx0 + x0, bx0 + x1, ny0 + y0) for by0, by1, bx0, bx1, ny0 in boxes
+                     for y0, y1, x0, x1 in changed_tiles(baseline_np[by0:by1, bx0:bx1],
+                                                         new_np[ny0:ny0 + by1 - by0, bx0:bx1], tile, min_tile)]
+
+    deleted = [(max(a0, y0), min(a1, y1), x0, x1) for band in bands if band['type'] == 'deleted'
+               for a0, a1 in [band['baseline_rows']] for y0, y1, x0, x1 in rects if max(a0, y0) < min(a1, y1)]
+    # Nothing outside this window can have changed, so the threshold mask and the region
+    # scan only cover it (an ROI-only check never touches the rest of the page). The gray
+    # difference stays full size for the heatmap.
+    window = changed_window(boxes, deleted)
+    wy0, wy1, wx0, wx1 = window or (0, 0, 0, 0)
+
+    # Only the gray difference is assembled; the heatmap is colored from it
+    gray_diff = thresh = None
+    histogram = np.zeros(256, dtype=np.int64)
+    for y0, y1, x0, x1, ny0 in boxes:
+        with timer.stage("absdiff"):
+            diff_tile = cv2.absdiff(baseline_np[y0:y1, x0:x1], new_np[ny0:ny0 + y1 - y0, x0:x1])
+        gray_tile, thresh_tile = threshold_diff(diff_tile, tolerance, timer)
+        with timer.stage("histogram"):
+            histogram += gray_histogram(gray_tile)
+        if (y0, y1, x0, x1) == (0, height, 0, width):
+            # Plain positional compare: keep the arrays instead of copying them into place
+            gray_diff, thresh = gray_tile, thresh_tile
+            continue
+        if gray_diff is None:
+            gray_diff = np.zeros((height, width), dtype=np.uint8)
+            thresh = np.zeros((wy1 - wy0, wx1 - wx0), dtype=np.uint8)
+        gray_diff[y0:y1, x0:x1] = gray_tile
+        thresh[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0] = thresh_tile
+
+    if gray_diff is None:
+        gray_diff = np.zeros((height, width), dtype=np.uint8)
+        thresh = np.zeros((wy1 - wy0, wx1 - wx0), dtype=np.uint8)
+    for y0, y1, x0, x1 in deleted:
+        gray_diff[y0:y1, x0:x1] = 255
+        thresh[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0] = 255 if tolerance < 255 else 0
+        histogram[255] += (y1 - y0) * (x1 - x0)
+    histogram[0] += sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in rects) - int(histogram.sum())
+    for band in bands:
+        if band['type'] == 'inserted':
+            # Inserted rows are checked as wide as the baseline row they are inserted at
+            b0, b1 = band['new_rows']
+            histogram[255] += (b1 - b0) * row_coverage(rects, min(band['baseline_row'], height - 1))
+
+    # Regions are extracted once over the assembled mask, so boxes spanning tiles and spans stay whole
+    with timer.stage("regions"):
+        regions = offset_regions(extract_regions(thresh, gray_diff[wy0:wy1, wx0:wx1]), wx0, wy0) if window else []
+
+    highlighted = diff_img = None
+    with timer.stage("overlay"):
+        if draw:
+            highlighted = draw_regions(baseline_np, regions, bands)
+            diff_img = Image.fromarray(colorize(gray_diff))
+
+    result = {
+        'highlighted': highlighted,
+        'diff_img': diff_img,
+        'diff_percent': diff_percent_at(histogram, tolerance),
+        'regions': regions,
+        'size': (width, height),
+        'warnings': warnings,
+        'histogram': histogram,
+        'gray_diff': gray_diff,
+        'window': window,
+        'bands': bands,
+        'checked_pixels': int(histogram.sum()),
+        'timings': timer.record()
+    }
+    if tile:
+        result['tiles_diffed'] = len(boxes)
+    return result
+
+# ========== Tiled Comparison ==========
+# Working bytes per pixel of one band: diff (3), gray (1), thresh (1), grouped mask (1), int32 labels (4)
+BAND_BYTES_PER_PIXEL = 10
+
+def band_rows_for(width, max_band_mb=64):
+    return max(1, int(max_band_mb * 1024 * 1024 // (max(1, width) * BAND_BYTES_PER_PIXEL)))
+
+def _find(parent, node):
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+def _seam_pairs(upper_row, lower_row):
+    # 8-connected label pairs touching across a band seam
+    width = len(upper_row)
+    pairs = []
+    for dx in (-1, 0, 1):
+        a = upper_row[max(0, -dx):width - max(0, dx)]
+        b = lower_row[max(0, dx):width - max(0, -dx)]
+        both = (a > 0) & (b > 0)
+        if both.any():
+            pairs.append(np.stack([a[both], b[both]], axis=1))
+    if not pairs:
+        return []
+    return np.unique(np.concatenate(pairs), axis=0).tolist()
+
+def _link_seams(prev_bottom, top, parent):
+    # Unions the groups on the last row of the band above with those they touch on
+    # the first row of this band; both rows hold global labels (0 = background)
+    for a, b in _seam_pairs(prev_bottom, top):
+        ra, rb = _find(parent, a), _find(parent, b)
+        if ra != rb:
+            parent[rb] = ra
+
+def _merge_groups(parent, groups):
+    merged = {}
+    for node, (x0, y0, x1, y1, area, total) in groups.items():
+        root = _find(parent, node)
+        if root in merged:
+            mx0, my0, mx1, my1, marea, mtotal = merged[root]
+            merged[root] = (min(mx0, x0), min(my0, y0), max(mx1, x1), max(my1, y1), marea + area, mtotal + total)
+        else:
+            merged[root] = (x0, y0, x1, y1, area, total)
+    return merged.values()
+
+def compare_images_tiled(baseline_img, new_img, tolerance=50, draw=True, band_rows=None, max_band_mb=64, fail_threshold=None, timer=None):
+    # Same diff % and regions as compare_images, but every stage runs on horizontal bands
+    # so working memory stays at max_band_mb however tall the page is. Each band is
+    # diffed with r rows of context so its slice of the grouped (dilated) mask is exactly
+    # that of the whole image; groups cut by a seam are joined through their labels.
+    timer = timer or StageTimer()
+    baseline_np, new_np, warnings = load_pair(baseline_img, new_img, timer)
+
+    height, width = baseline_np.shape[:2]
+    size = (width, height)
+    band_rows = band_rows or band_rows_for(width, max_band_mb)
+    total_pixels = height * width
+    diff_pixels = 0
+    histogram = np.zeros(256, dtype=np.int64)
+    r = (MERGE_DISTANCE + 1) // 2
+    # Groups that don't touch a seam are final straight away; the rest go through union-find
+    final_boxes, final_areas, final_totals = [], [], []
+    parent, groups = {}, {}
+    label_offset = 0
+    prev_bottom = None
+    early_exit = False
+    band_count = 0
+
+    for y0 in range(0, height, band_rows):
+        y1 = min(y0 + band_rows, height)
+        band_count += 1
+        # Rows of the padded grouped mask owned by this band; the first and last bands
+        # also own the padding above and below the image
+        p0 = 0 if y0 == 0 else y0 + r
+        p1 = height + 2 * r if y1 == height else y1 + r
+        a, b = max(0, y0 - r), min(height, y1 + r)
+        with timer.stage("absdiff"):
+            diff_band = cv2.absdiff(baseline_np[a:b], new_np[a:b])
+        gray_ctx, thresh_ctx = threshold_diff(diff_band, tolerance, timer)
+        gray_diff, thresh = gray_ctx[y0 - a:y1 - a], thresh_ctx[y0 - a:y1 - a]
+        with timer.stage("histogram"):
+            histogram += gray_histogram(gray_diff)
+            diff_pixels += cv2.countNonZero(thresh)
+
+        if not cv2.countNonZero(thresh_ctx):
+            # Nothing changed in or around this band: no groups, nothing to link below
+            prev_bottom = None
+        else:
+            with timer.stage("regions"):
+                grouped, _ = group_mask(thresh_ctx, MERGE_DISTANCE, top=(a + r) - (p0 - r), bottom=(p1 + r) - (b + r))
+                grouped = grouped[r:r + p1 - p0]
+                top_row = np.zeros(grouped.shape[1], dtype=np.int64)
+                bottom_row = np.zeros(grouped.shape[1], dtype=np.int64)
+                for ry0, ry1, x0, labels, stats, areas, totals in label_runs(grouped, thresh, gray_diff, r, y0 + r - p0):
+                    stats[:, 1] += p0
+                    touches_top = (stats[:, 1] == p0) & (y0 > 0)
+                    touches_bottom = (stats[:, 1] + stats[:, 3] == p1) & (y1 < height)
+                    seam = touches_top | touches_bottom
+                    seam[0] = False
+                    interior = ~seam
+                    interior[0] = False
+                    final_boxes.append(stats[interior, :4])
+                    final_areas.append(areas[interior])
+                    final_totals.append(totals[interior])
+                    # Seam groups are kept as (x0, y0, x1, y1, area, total) under global labels
+                    for i, (x, y, w, h) in zip(np.flatnonzero(seam), stats[seam, :4]):
+                        node = label_offset + int(i)
+                        parent[node] = node
+                        groups[node] = (int(x), int(y), int(x + w), int(y + h), int(areas[i]), float(totals[i]))
+                    if ry0 == 0:
+                        top_row[x0:x0 + labels.shape[1]] = np.where(labels[0] > 0, labels[0] + label_offset, 0)
+                    if ry1 == p1 - p0:
+                        bottom_row[x0:x0 + labels.shape[1]] = np.where(labels[-1] > 0, labels[-1] + label_offset, 0)
+                    label_offset += len(stats)
+
+            if prev_bottom is not None:
+                with timer.stage("seams"):
+                    _link_seams(prev_bottom, top_row, parent)
+            prev_bottom = bottom_row
+
+        if fail_threshold is not None and round(diff_pixels / total_pixels * 100, 2) >= fail_threshold:
+            early_exit = y1 < height
+            break
+
+    for x0, y0, x1, y1, area, total in _merge_groups(parent, groups):
+        final_boxes.append(np.array([[x0, y0, x1 - x0, y1 - y0]]))
+        final_areas.append(np.array([area]))
+        final_totals.append(np.array([total]))
+    regions = finish_regions(np.concatenate(final_boxes), np.concatenate(final_areas),
+                             np.concatenate(final_totals), r) if final_boxes else []
+
+    highlighted = None
+    if draw:
+        # The baseline array is ours and no longer needed for diffing, so draw in place
+        with timer.stage("overlay"):
+            highlighted = draw_regions(baseline_np, regions)
+
+    diff_percent = (diff_pixels / total_pixels) * 100 if total_pixels > 0 else 0
+    return {
+        'highlighted': highlighted,
+        'diff_img': None,
+        'diff_percent': round(diff_percent, 2),
+        'regions': regions,
+        'size': size,
+        'warnings': warnings,
+        'histogram': histogram,
+        'bands': [],
+        'band_count': band_count,
+        'early_exit': early_exit,
+        'timings': timer.record()
+    }
+
+# ========== Structural Similarity ==========
+# Alternative to the tolerance threshold: SSIM per block, which shrugs off anti-aliasing
+# and font-rendering jitter but catches low-contrast structural changes. A block fails
+# when its score is below the threshold; the diff % is the share of checked pixels in
+# failing blocks. Rows are aligned and masks applied as in compare_images: the new image
+# is laid out on the baseline's grid and everything not compared is the baseline itself,
+# so it scores exactly 1. Blocks with deleted rows score 0 and inserted rows count as
+# changed, like in the pixel diff.
+def compare_images_ssim(baseline_img, new_img, threshold=SSIM_THRESHOLD, draw=True, block=SSIM_BLOCK, align=True,
+                        ignore=None, include=None, timer=None):
+    timer = timer or StageTimer()
+    baseline_np, new_np, warnings = load_pair(baseline_img, new_img, timer, align)
+    height, width = baseline_np.shape[:2]
+    rects = checked_rects(width, height, ignore, include)
+    align = align and (not include or new_np.shape[0] != height)
+    spans, bands = match_rows(baseline_np, new_np, align, timer)
+    boxes = span_boxes(spans, rects)
+
+    with timer.stage("grayscale"):
+        gray_a = cv2.cvtColor(baseline_np, cv2.COLOR_RGB2GRAY)
+        if boxes == [(0, height, 0, width, 0)]:
+            gray_b = cv2.cvtColor(new_np, cv2.COLOR_RGB2GRAY)
+        else:
+            gray_b = gray_a.copy()
+            for y0, y1, x0, x1, ny0 in boxes:
+                gray_b[y0:y1, x0:x1] = cv2.cvtColor(new_np[ny0:ny0 + y1 - y0, x0:x1], cv2.COLOR_RGB2GRAY)
+    with timer.stage("ssim"):
+        scores = ssim.block_ssim(gray_a, gray_b, block)
+        pixels = block_pixels(rects, height, width, block)
+        inserted = 0
+        for band in bands:
+            if band['type'] == 'deleted':
+                a0, a1 = band['baseline_rows']
+                deleted = [(max(a0, y0), min(a1, y1), x0, x1) for y0, y1, x0, x1 in rects if max(a0, y0) < min(a1, y1)]
+                scores[block_pixels(deleted, height, width, block) > 0] = 0
+            else:
+                b0, b1 = band['new_rows']
+                inserted += (b1 - b0) * row_coverage(rects, min(band['baseline_row'], height - 1))
+
+    summary = {
+        'score': ssim_score(scores, pixels, inserted),
+        'threshold': threshold,
+        'block': block,
+        'size': (width, height),
+        'scores': scores,
+        'pixels': pixels,
+        'inserted': inserted
+    }
+    with timer.stage("regions"):
+        regions = ssim_regions(summary, threshold)
+
+    highlighted = diff_img = None
+    with timer.stage("overlay"):
+        if draw:
+            highlighted = draw_regions(baseline_np, regions, bands)
+            diff_img = Image.fromarray(colorize(ssim_heatmap(summary)))
+
+    return {
+        'highlighted': highlighted,
+        'diff_img': diff_img,
+        'diff_percent': ssim_diff_percent(summary, threshold),
+        'regions': regions,
+        'size': (width, height),
+        'warnings': warnings,
+        'histogram': None,
+        'gray_diff': None,
+        'bands': bands,
+        'checked_pixels': int(pixels.sum()) + inserted,
+        'ssim': summary,
+        'timings': timer.record()
+    }
+
+def block_pixels(rects, height, width, block):
+    # Checked pixels per block; the rectangles are disjoint, so their overlaps just add up
+    rows, cols = ssim.grid_shape(height, width, block)
+    ys, xs = np.arange(rows) * block, np.arange(cols) * block
+    counts = np.zeros((rows, cols), dtype=np.int64)
+    for y0, y1, x0, x1 in rects:
+        dy = np.clip(np.minimum(ys + block, y1) - np.maximum(ys, y0), 0, None)
+        dx = np.clip(np.minimum(xs + block, x1) - np.maximum(xs, x0), 0, None)
+        counts += np.outer(dy, dx)
+    return counts
+
+def ssim_score(scores, pixels, inserted=0):
+    # Global SSIM: block scores weighted by their checked pixels, inserted rows scoring 0
+    total = int(pixels.sum()) + inserted
+    return round(float((scores * pixels).sum()) / total, 4) if total else 1.0
+
+def ssim_sweep(summary, steps=101):
+    # Diff % at every threshold from 0 to 1, like tolerance_sweep for the pixel diff
+    total = int(summary['pixels'].sum()) + summary['inserted']
+    if total == 0:
+        return np.zeros(steps)
+    order = np.argsort(summary['scores'], axis=None)
+    below = np.concatenate(([0], np.cumsum(summary['pixels'].ravel()[order])))
+    failing = below[np.searchsorted(summary['scores'].ravel()[order], np.linspace(0, 1, steps))]
+    return (failing + summary['inserted']) / total * 100
+
+def ssim_diff_percent(summary, threshold):
+    total = int(summary['pixels'].sum()) + summary['inserted']
+    if total == 0:
+        return 0.0
+    failing = int(summary['pixels'][summary['scores'] < threshold].sum())
+    return round((failing + summary['inserted']) / total * 100, 2)
+
+def ssim_regions(summary, threshold, max_regions=MAX_REGIONS):
+    # Failing blocks joined 8-connected; boxes in pixels, clipped to the image
+    block, (width, height) = summary['block'], summary['size']
+    scores, pixels = summary['scores'], summary['pixels']
+    failing = (scores < threshold) & (pixels > 0)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(failing.astype(np.uint8), connectivity=8)
+    if count <= 1:
+        return []
+    owners = labels[failing]
+    areas = np.bincount(owners, weights=pixels[failing], minlength=count)
+    totals = np.bincount(owners, weights=(scores * pixels)[failing], minlength=count)
+    keep = np.arange(1, count)
+    keep = keep[np.argsort(-areas[keep], kind="stable")][:max_regions]
+    regions = []
+    for i in keep:
+        x, y, w, h = (int(v) for v in stats[i, :4])
+        regions.append({
+            'x': x * block,
+            'y': y * block,
+            'w': min((x + w) * block, width) - x * block,
+            'h': min((y + h) * block, height) - y * block,
+            'area': int(areas[i]),
+            'mean_ssim': round(float(totals[i]) / float(areas[i]), 3)
+        })
+    regions.sort(key=lambda region: (region['y'], region['x']))
+    return regions
+
+def ssim_heatmap(summary):
+    # 1 - SSIM per block as a full-size gray image; unchecked blocks stay black
+    block, (width, height) = summary['block'], summary['size']
+    scores = summary['scores']
+    heat = np.where(summary['pixels'] > 0, np.clip(1 - scores, 0, 1) * 255, 0).astype(np.uint8)
+    heat = cv2.resize(heat, (scores.shape[1] * block, scores.shape[0] * block), interpolation=cv2.INTER_NEAREST)
+    return np.ascontiguousarray(heat[:height, :width])
+
+# ========== Heatmap ==========
+def _heatmap_lut():
+    # Square-root stretch then the inferno colormap, as one 256-entry RGB table: a gray
+    # difference of 10 out of 255 already lands a fifth of the way up the scale
+    stretched = (np.sqrt(np.arange(256) / 255) * 255).round().astype(np.uint8).reshape(256, 1)
+    return np.ascontiguousarray(cv2.applyColorMap(stretched, cv2.COLORMAP_INFERNO)[:, :, ::-1])
+
+HEATMAP_LUT = _heatmap_lut()
+
+def colorize(gray):
+    # uint8 intensities to RGB through HEATMAP_LUT, one table lookup per pixel
+    return cv2.applyColorMap(gray, HEATMAP_LUT)
+
+# ========== Change Accumulation ==========
+# History keeps per-baseline counts of how often each cell changed (see
+# HistoryStore.record_changes); these turn them into an overlay and boxes
+def change_overlay(baseline_img, counts, runs, cell, alpha=0.6):
+    # The baseline with each cell tinted by the share of runs that changed it; cells
+    # that never changed are left as they are
+    base = ingest.to_rgb(baseline_img)
+    height, width = base.shape[:2]
+    share = (counts.astype(np.float32) * (255 / max(1, runs))).clip(0, 255).astype(np.uint8)
+    share = cv2.resize(share, (counts.shape[1] * cell, counts.shape[0] * cell), interpolation=cv2.INTER_NEAREST)
+    share = np.ascontiguousarray(share[:height, :width])
+    tinted = cv2.addWeighted(base, 1 - alpha, colorize(share), alpha, 0)
+    return Image.fromarray(np.where((share > 0)[:, :, None], tinted, base))
+
+def frequent_regions(counts, runs, cell, min_share=0.2):
+    # Boxes of connected cells that changed in at least min_share of the runs, most
+    # frequent first, in baseline pixels
+    if not runs:
+        return []
+    frequent = (counts >= max(1, min_share * runs)).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(frequent, connectivity=8)
+    regions = []
+    for i in range(1, count):
+        x, y, w, h = (int(v) for v in stats[i, :4])
+        share = counts[y:y + h, x:x + w][labels[y:y + h, x:x + w] == i].max()
+        regions.append({'x': x * cell, 'y': y * cell, 'w': w * cell, 'h': h * cell,
+                        'changed_in': round(float(share) / runs * 100, 1)})
+    regions.sort(key=lambda region: -region['changed_in'])
+    return regions
+
+# ========== Thresholds ==========
+def classify(diff_percent, pass_threshold=10, fail_threshold=70):
+    # Same bands as the summary in show_results
+    if diff_percent <= pass_threshold:
+        return "pass"
+    if diff_percent >= fail_threshold:
+        return "fail"
+    severity_ratio = (diff_percent - pass_threshold) / (fail_threshold - pass_threshold)
+    if severity_ratio < 0.33:
+        return "minor"
+    if severity_ratio < 0.67:
+        return "moderate"
+    return "critical"
+
+# ========== Batch Worker ==========
+def compare_pair(task):
+    # Runs in pool workers: takes a plain dict and returns a JSON-ready record
+    start = time.perf_counter()
+    record = {
+        "name": task["name"],
+        "baseline": task["baseline"],
+        "new": task["new"]
+    }
+    try:
+        masks = {"ignore": task.get("ignore"), "include": task.get("include")}
+        if task.get("metric") == "ssim":
+            if task.get("tiled"):
+                raise ValueError("SSIM is not supported in tiled mode")
+            result = compare_images_ssim(task["baseline"], task["new"], task.get("ssim_threshold", SSIM_THRESHOLD),
+                                         draw=False, block=task.get("block", SSIM_BLOCK),
+                                         align=task.get("align", True), **masks)
+        elif task.get("tiled"):
+            if masks["ignore"] or masks["include"]:
+                raise ValueError("ignore/include masks are not supported in tiled mode")
+            result = compare_images_tiled(task["baseline"], task["new"], task.get("tolerance", 50), draw=False,
+                                          max_band_mb=task.get("max_band_mb", 64),
+                                          fail_threshold=task.get("fail_threshold", 70) if task.get("early_exit") else None)
+        elif task.get("coarse_to_fine"):
+            result = compare_images_coarse_to_fine(task["baseline"], task["new"], task.get("tolerance", 50), draw=False,
+                                                   align=task.get("align", True), **masks)
+        else:
+            result = compare_images(task["baseline"], task["new"], task.get("tolerance", 50), draw=False,
+                                    align=task.get("align", True), **masks)
+        record.update({
+            "diff_percent": result['diff_percent'],
+            "status": classify(result['diff_percent'], task.get("pass_threshold", 10), task.get("fail_threshold", 70)),
+            "regions": result['regions'],
+            "bands": result.get('bands', []),
+            "warnings": result['warnings'],
+            "early_exit": result.get('early_exit', False),
+            "timings": result['timings']['stages']
+        })
+        if result.get('ssim'):
+            record["ssim"] = result['ssim']['score']
+    except Exception as e:
+        record.update({"diff_percent": None, "status": "error", "regions": [], "error": str(e)})
+    record["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return record
+
+def init_worker():
+    # One process per core already; keep OpenCV from oversubscribing threads
+    cv2.setNumThreads(1)
+
+def default_workers():
+    return os.cpu_count() or 1
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from PIL import Image
+
+import preview
+from timing import StageTimer, lazy_import
+
+# Only change maps need NumPy; the app imports this module before its first render
+np = lazy_import("numpy")
+
+HISTORY_DIR = os.environ.get("VRA_HISTORY_DIR", os.path.expanduser("~/.cache/visual-regression-analyzer/history"))
+THUMBNAIL_SIZE = (preview.THUMB_SIDE, preview.THUMB_SIDE)
+CHANGE_CELL = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    diff_percent REAL NOT NULL,
+    tolerance INTEGER,
+    width INTEGER,
+    height INTEGER,
+    baseline TEXT NOT NULL,
+    new_image TEXT NOT NULL,
+    highlighted TEXT NOT NULL,
+    annotations TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS baselines (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image TEXT NOT NULL UNIQUE,
+    dhash INTEGER NOT NULL,
+    name TEXT,
+    width INTEGER,
+    height INTEGER,
+    approved TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS change_maps (
+    baseline TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    cell INTEGER NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS change_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    baseline TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    diff_percent REAL,
+    changed_cells INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS change_runs_baseline ON change_runs (baseline, id);
+CREATE TABLE IF NOT EXISTS masks (
+    baseline TEXT PRIMARY KEY,
+    ignore TEXT NOT NULL DEFAULT '[]',
+    include TEXT NOT NULL DEFAULT '[]',
+    updated TEXT NOT NULL
+);
+"""
+
+# ========== History Store ==========
+class HistoryStore:
+    # Images live once on disk under their content hash (objects/ab/abcd....png, with a
+    # thumbnail beside them); comparisons are rows in a SQLite index pointing at those hashes.
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.db_path = os.path.join(root, "index.sqlite")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the store safe to share across Streamlit threads
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _object_path(self, key, suffix=""):
+        return os.path.join(self.root, "objects", key[:2], f"{key}{suffix}.png")
+
+    # ---------- Images ----------
+    def put_image(self, image, timer=None):
+        timer = timer or StageTimer()
+        with timer.stage("history_save"):
+            if image.mode not in ("RGB", "RGBA", "L"):
+                image = image.convert("RGB")
+            digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+            digest.update(image.tobytes())
+            key = digest.hexdigest()
+            path = self._object_path(key)
+            exists = os.path.exists(path)
+
+        if not exists:
+            # Already-stored images are neither re-encoded nor re-thumbnailed
+            with timer.stage("png_encode"):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                thumb = image.copy()
+                thumb.thumbnail(THUMBNAIL_SIZE)
+                self._write_png(thumb, self._object_path(key, ".thumb"))
+                self._write_png(image, path)
+        return key
+
+    def _write_png(self, image, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+
+    def image(self, key):
+        return self._open(self._object_path(key))
+
+    def image_path(self, key):
+        return self._object_path(key)
+
+    def thumbnail(self, key):
+        return self._open(self._object_path(key, ".thumb"))
+
+    def _open(self, path):
+        with Image.open(path) as image:
+            image.load()
+        return image
+
+    # ---------- Comparisons ----------
+    def add(self, baseline, new_image, highlighted, diff_percent, tolerance=None, annotations=None, timer=None):
+        timer = timer or StageTimer()
+        row = (
+            time.strftime("%Y-%m-%d %H:%M:%S"),
+            diff_percent,
+            tolerance,
+            baseline.size[0],
+            baseline.size[1],
+            self.put_image(baseline, timer),
+            self.put_image(new_image, timer),
+            self.put_image(highlighted, timer),
+            json.dumps(annotations or [])
+        )
+        with timer.stage("history_save"), self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO comparisons (timestamp, diff_percent, tolerance, width, height, baseline, new_image, highlighted, annotations) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            return cursor.lastrowid
+
+    def recent(self, limit=10, offset=0):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM comparisons ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def get(self, entry_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM comparisons WHERE id = ?", (entry_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM comparisons").fetchone()[0]
+
+    # ---------- Masks ----------
+    # Ignore rectangles and include ROIs, (x, y, w, h) each, saved per baseline key so
+    # every later comparison against the same baseline picks them up
+    def masks(self, baseline_key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT ignore, include FROM masks WHERE baseline = ?", (baseline_key,)).fetchone()
+        if not row:
+            return {"ignore": [], "include": []}
+        return {"ignore": json.loads(row["ignore"]), "include": json.loads(row["include"])}
+
+    def set_masks(self, baseline_key, ignore=(), include=()):
+        with self._connect() as conn:
+            if not ignore and not include:
+                conn.execute("DELETE FROM masks WHERE baseline = ?", (baseline_key,))
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO masks (baseline, ignore, include, updated) VALUES (?, ?, ?, ?)",
+                (baseline_key, json.dumps([list(r) for r in ignore]), json.dumps([list(r) for r in include]),
+                 time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    # ---------- Baselines ----------
+    # Approved baselines with their perceptual hash; baseline_index.BaselineIndex keeps
+    # the in-memory lookup structure and picks up new rows by id
+    def add_baseline(self, image, dhash, name=None, timer=None):
+        key = self.put_image(image, timer)
+        with self._connect() as conn:
+            # Re-approving an image keeps its original entry
+            conn.execute(
+                "INSERT OR IGNORE INTO baselines (image, dhash, name, width, height, approved) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, dhash, name, image.size[0], image.size[1], time.strftime("%Y-%m-%d %H:%M:%S")))
+            return conn.execute("SELECT id FROM baselines WHERE image = ?", (key,)).fetchone()[0]
+
+    def baseline_hashes(self, after_id=0):
+        # (id, dhash) of baselines added after after_id, oldest first
+        with self._connect() as conn:
+            return conn.execute("SELECT id, dhash FROM baselines WHERE id > ? ORDER BY id", (after_id,)).fetchall()
+
+    def baselines(self, ids):
+        if not ids:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM baselines WHERE id IN ({','.join('?' * len(ids))})", list(ids)).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---------- Change Maps ----------
+    # Per baseline key, how many comparisons changed each CHANGE_CELL x CHANGE_CELL cell.
+    # The counts are a .npy file updated in place through a memory map, so recording a
+    # comparison costs one pass over a small grid however long the history is, and past
+    # images are never read again. A baseline whose size changes starts a new map.
+    def _change_map_path(self, key):
+        return os.path.join(self.root, "changes", key[:2], f"{key}.npy")
+
+    def record_changes(self, baseline_key, size, regions, diff_percent=None, cell=CHANGE_CELL, timer=None):
+        timer = timer or StageTimer()
+        width, height = size
+        rows, cols = -(-height // cell), -(-width // cell)
+        changed = np.zeros((rows, cols), dtype=bool)
+        for r in regions:
+            changed[r['y'] // cell:-(-(r['y'] + r['h']) // cell), r['x'] // cell:-(-(r['x'] + r['w']) // cell)] = True
+        path = self._change_map_path(baseline_key)
+        with timer.stage("history_save"), self._connect() as conn:
+            # Taking the write lock first serializes updates from other threads and processes
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT width, height, cell FROM change_maps WHERE baseline = ?", (baseline_key,)).fetchone()
+            if row is None or tuple(row) != (width, height, cell) or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                counts = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint32, shape=(rows, cols))
+                conn.execute("DELETE FROM change_runs WHERE baseline = ?", (baseline_key,))
+                conn.execute("INSERT OR REPLACE INTO change_maps (baseline, width, height, cell, runs, updated) VALUES (?, ?, ?, ?, 0, ?)",
+                             (baseline_key, width, height, cell, time.strftime("%Y-%m-%d %H:%M:%S")))
+            else:
+                counts = np.lib.format.open_memmap(path, mode="r+")
+            counts[changed] += 1
+            counts.flush()
+            del counts
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            conn.execute("UPDATE change_maps SET runs = runs + 1, updated = ? WHERE baseline = ?", (timestamp, baseline_key))
+            conn.execute("INSERT INTO change_runs (baseline, timestamp, diff_percent, changed_cells) VALUES (?, ?, ?, ?)",
+                         (baseline_key, timestamp, diff_percent, int(changed.sum())))
+
+    def change_map(self, baseline_key):
+        # {counts, runs, cell, width, height} of a baseline, or None before its first run
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM change_maps WHERE baseline = ?", (baseline_key,)).fetchone()
+            path = self._change_map_path(baseline_key)
+            if not row or not os.path.exists(path):
+                return None
+            # A run recorded meanwhile can show up in the counts before the run count; the
+            # shares are off by one run at most
+            counts = np.load(path)
+        return dict(row, counts=counts)
+
+    def change_trend(self, baseline_key, limit=500):
+        # The most recent runs against a baseline, oldest first
+        with self._connect() as conn:
+            rows = conn.execute("SELECT timestamp, diff_percent, changed_cells FROM change_runs WHERE baseline = ? "
+                                "ORDER BY id DESC LIMIT ?", (baseline_key, limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry["annotations"] = json.loads(entry["annotations"])
+        return entry
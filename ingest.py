@@ -0,0 +1,143 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from timing import status_kb
+
+# cv2.imdecode flags per preview reduction; JPEG scales down inside the IDCT,
+# other formats decode at full size and are then resized by OpenCV
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# ========== Decoding ==========
+def decode_bytes(data, reduce=1):
+    # Encoded bytes straight to one contiguous RGB uint8 array. IMREAD_COLOR drops alpha
+    # and expands gray/palette inside the decoder, and the BGR -> RGB swap happens in place.
+    flags = REDUCED_FLAGS[reduce] | cv2.IMREAD_IGNORE_ORIENTATION
+    array = cv2.imdecode(np.frombuffer(memoryview(data), dtype=np.uint8), flags)
+    if array is None:
+        # Formats this OpenCV build can't read still go through Pillow
+        return _decode_pil(data, reduce)
+    cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array)
+    return array
+
+def _decode_pil(data, reduce=1):
+    with Image.open(BytesIO(data)) as image:
+        if reduce > 1:
+            # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale; reduce() makes up the rest
+            target = max(1, image.size[0] // reduce)
+            image.draft("RGB", (target, max(1, image.size[1] // reduce)))
+            reduce = max(1, image.size[0] // target)
+        return pil_to_array(image, reduce)
+
+def pil_to_array(image, reduce=1):
+    # convert() copies even when the mode already matches, so only call it when needed
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if reduce > 1:
+        image = image.reduce(reduce)
+    return np.array(image)
+
+def array_to_rgb(array):
+    if array.dtype != np.uint8:
+        raise ValueError(f"Expected a uint8 image array, got {array.dtype}")
+    if array.ndim == 2:
+        return cv2.cvtColor(array, cv2.COLOR_GRAY2RGB)
+    if array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_RGBA2RGB)
+    return np.ascontiguousarray(array)
+
+def read_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+def to_rgb(source, reduce=1):
+    # Any supported source (encoded bytes, a path or file object, a PIL image or an
+    # array) as a contiguous RGB uint8 array, converting only what isn't RGB already
+    if isinstance(source, np.ndarray):
+        return array_to_rgb(source)
+    if isinstance(source, Image.Image):
+        return pil_to_array(source, reduce)
+    return decode_bytes(read_bytes(source), reduce)
+
+def preview_reduce(size, max_side):
+    # Largest decoder reduction that still keeps the preview at least max_side wide/tall
+    for reduce in (8, 4, 2):
+        if max(size) // reduce >= max_side:
+            return reduce
+    return 1
+
+# ========== Benchmark ==========
+# Compares the old Image.open -> convert('RGB') -> np.array path with decode_bytes.
+# Peak memory is the growth of max RSS in a freshly spawned process, so Pillow's and
+# OpenCV's native buffers count too, not just Python allocations.
+def legacy_decode(data):
+    image = Image.open(BytesIO(data))
+    image.load()
+    return np.array(image.convert("RGB"))
+
+METHODS = {
+    "pil": legacy_decode,
+    "ingest": decode_bytes,
+    "ingest_reduced": lambda data: decode_bytes(data, 4)
+}
+
+def _peak_child(method, data, queue):
+    before = status_kb("VmHWM")
+    METHODS[method](data)
+    queue.put(status_kb("VmHWM") - before)
+
+def peak_kb(method, data):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    child = context.Process(target=_peak_child, args=(method, data, queue))
+    child.start()
+    peak = queue.get()
+    child.join()
+    return peak
+
+def bench(path, repeat=5):
+    with open(path, "rb") as f:
+        data = f.read()
+    for method, decode in METHODS.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            array = decode(data)
+            times.append((time.perf_counter() - start) * 1000)
+        yield {
+            "path": path,
+            "method": method,
+            "shape": list(array.shape),
+            "median_ms": round(sorted(times)[len(times) // 2], 2),
+            "peak_mb": round(peak_kb(method, data) / 1024, 1)
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time and measure peak memory of image decoding paths.")
+    parser.add_argument("images", nargs="+", help="Encoded images to decode")
+    parser.add_argument("--repeat", type=int, default=5, help="Decodes per method; the median is reported")
+    args = parser.parse_args(argv)
+    for path in args.images:
+        for record in bench(path, args.repeat):
+            print(json.dumps(record))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+from PIL import Image
+
+# Longest side of each preview level: history thumbnails, on-screen images and the
+# annotation canvas, and zoomed crops
+THUMB_SIDE = 320
+SCREEN_SIDE = 1024
+DETAIL_SIDE = 2048
+LEVELS = (DETAIL_SIDE, SCREEN_SIDE, THUMB_SIDE)
+ZOOM_PADDING = 32
+
+# ========== Pyramid ==========
+def build_pyramid(image, levels=LEVELS):
+    # Every level is downscaled from the one above it, so the full-resolution image is
+    # read once however many levels there are. Images already smaller are not upscaled.
+    pyramid = {}
+    source = image
+    for side in sorted(levels, reverse=True):
+        if max(source.size) > side:
+            source = source.copy()
+            source.thumbnail((side, side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        pyramid[side] = source
+    return pyramid
+
+def preview(cache, key, image, max_side=SCREEN_SIDE):
+    # One level of the image's pyramid; the whole pyramid is built on the first request
+    # and kept in the LRU cache under the image's content key. image may also be a
+    # function loading it, which is then only called on a cache miss.
+    load = image if callable(image) else lambda: image
+    if key is None:
+        return build_pyramid(load(), (max_side,))[max_side]
+    return cache.get_or_compute(("pyramid", key), lambda: build_pyramid(load()))[max_side]
+
+# ========== Coordinates ==========
+def to_full_resolution(objects, full_size, shown_size):
+    # Canvas shapes drawn on a preview, with positions and sizes in full-resolution pixels
+    sx, sy = full_size[0] / shown_size[0], full_size[1] / shown_size[1]
+    if sx == 1 and sy == 1:
+        return list(objects or [])
+    scaled = []
+    for obj in objects or []:
+        obj = dict(obj)
+        for field, scale in (("left", sx), ("width", sx), ("top", sy), ("height", sy)):
+            if field in obj:
+                obj[field] = obj[field] * scale
+        scaled.append(obj)
+    return scaled
+
+def zoom(image, box, padding=ZOOM_PADDING, max_side=DETAIL_SIDE):
+    # Full-resolution pixels around an (x, y, w, h) box, only downscaled when the crop
+    # itself is larger than max_side
+    x, y, w, h = box
+    region = image.crop((max(0, x - padding), max(0, y - padding),
+                         min(image.size[0], x + w + padding), min(image.size[1], y + h + padding)))
+    if max(region.size) > max_side:
+        region.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return region
@@ -0,0 +1,468 @@
+import argparse
+import base64
+import binascii
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from urllib.parse import parse_qs, urlsplit
+
+import cache
+import engine
+from history_store import HistoryStore
+
+MAX_QUEUE = 64
+KEEP_JOBS = 1000
+LATENCY_WINDOW = 1000
+THROUGHPUT_WINDOW = 60.0
+MAX_BODY_MB = 64
+# Job options and their types; query strings arrive as text and are converted
+OPTIONS = {
+    "name": str, "tolerance": int, "metric": str, "ssim_threshold": float, "block": int,
+    "pass_threshold": float, "fail_threshold": float, "coarse_to_fine": bool, "align": bool,
+    "width": int, "height": int, "full_page": bool
+}
+SOURCES = ("image", "id", "url")
+
+class JobError(ValueError):
+    pass
+
+class QueueFull(RuntimeError):
+    pass
+
+# ========== Metrics ==========
+def percentile(values, q):
+    # Nearest-rank percentile of an unsorted list
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class Metrics:
+    # Latencies of the last LATENCY_WINDOW jobs and completion times of the last
+    # THROUGHPUT_WINDOW seconds; counters cover the whole run
+    def __init__(self):
+        self.started = time.time()
+        self.counts = {"submitted": 0, "completed": 0, "errors": 0, "rejected": 0}
+        self.latencies = {"queue_ms": deque(maxlen=LATENCY_WINDOW), "run_ms": deque(maxlen=LATENCY_WINDOW),
+                          "total_ms": deque(maxlen=LATENCY_WINDOW)}
+        self.finished = deque()
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def record(self, job):
+        with self._lock:
+            self.counts["completed"] += 1
+            if job["status"] == "error":
+                self.counts["errors"] += 1
+            self.latencies["queue_ms"].append((job["started"] - job["submitted"]) * 1000)
+            self.latencies["run_ms"].append((job["finished"] - job["started"]) * 1000)
+            self.latencies["total_ms"].append((job["finished"] - job["submitted"]) * 1000)
+            self.finished.append(job["finished"])
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+                self.finished.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self.started)
+            latency = {name: {f"p{q}": _round(percentile(list(values), q)) for q in (50, 90, 99)}
+                       for name, values in self.latencies.items()}
+            return dict(self.counts, uptime_s=round(now - self.started, 1), latency=latency,
+                        throughput_per_s=round(len(self.finished) / window, 3) if window > 0 else 0.0)
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+# ========== Job Queue ==========
+class JobQueue:
+    # Jobs wait in a bounded queue; one dispatcher thread per worker process takes the
+    # next job, resolves its images (stored baselines, URL captures) in this process and
+    # runs the comparison in the pool, so at most `workers` comparisons are in flight
+    # and everything else is visible as queue depth.
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, store=None):
+        self.workers = workers or engine.default_workers()
+        self.store = store
+        self.metrics = Metrics()
+        self.spool = tempfile.mkdtemp(prefix="vra-service-")
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._running = 0
+        self._changed = threading.Condition()
+        self._capture_pool = None
+        self._capture_lock = threading.Lock()
+        self._pool = Pool(self.workers, initializer=engine.init_worker)
+        for i in range(self.workers):
+            threading.Thread(target=self._dispatch, name=f"dispatch-{i}", daemon=True).start()
+
+    def submit(self, spec, wait=0.0):
+        # Queues a job and returns its public state. When the queue is full the caller
+        # waits up to `wait` seconds for a slot, then gets QueueFull.
+        job = {"id": uuid.uuid4().hex, "status": "queued", "spec": spec, "record": None,
+               "submitted": time.time(), "started": None, "finished": None}
+        with self._changed:
+            self._jobs[job["id"]] = job
+        try:
+            if wait > 0:
+                self._queue.put(job, timeout=wait)
+            else:
+                self._queue.put_nowait(job)
+        except queue.Full:
+            with self._changed:
+                self._jobs.pop(job["id"], None)
+            self._discard(spec)
+            self.metrics.count("rejected")
+            raise QueueFull(f"queue is full ({self._queue.maxsize} jobs waiting)")
+        self.metrics.count("submitted")
+        return self.public(job)
+
+    def get(self, job_id, wait=0.0):
+        # A job's state, optionally long-polling up to `wait` seconds for it to finish
+        deadline = time.time() + wait
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["finished"] or time.time() >= deadline:
+                    return self.public(job) if job else None
+                self._changed.wait(deadline - time.time())
+
+    def follow(self, job_ids=None, timeout=None):
+        # Yields jobs as they finish: the given ones (ending once all are done) or every
+        # job finishing from now on
+        pending = set(job_ids) if job_ids else None
+        seen = set()
+        deadline = time.time() + timeout if timeout else None
+        with self._changed:
+            if pending is None:
+                seen = {job_id for job_id, job in self._jobs.items() if job["finished"]}
+        while pending is None or pending:
+            with self._changed:
+                seen &= self._jobs.keys()
+                done = [job for job_id, job in self._jobs.items()
+                        if job["finished"] and job_id not in seen and (pending is None or job_id in pending)]
+                if pending is not None:
+                    # Unknown or expired ids would otherwise be waited on forever
+                    pending = {job_id for job_id in pending if job_id in self._jobs} - {job["id"] for job in done}
+                if not done:
+                    if deadline and time.time() >= deadline:
+                        return
+                    self._changed.wait(1.0 if deadline is None else max(0.0, min(1.0, deadline - time.time())))
+                    continue
+            for job in done:
+                seen.add(job["id"])
+                yield self.public(job)
+
+    def public(self, job):
+        state = {key: job[key] for key in ("id", "status", "submitted", "started", "finished", "record")}
+        if job["status"] == "queued":
+            state["queue_depth"] = self._queue.qsize()
+        return state
+
+    def stats(self):
+        with self._changed:
+            running = self._running
+        return dict(self.metrics.snapshot(), queue_depth=self._queue.qsize(), queue_capacity=self._queue.maxsize,
+                    running=running, workers=self.workers)
+
+    def close(self):
+        self._pool.terminate()
+        if self._capture_pool:
+            self._capture_pool.close()
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    # ---------- Workers ----------
+    def _dispatch(self):
+        while True:
+            job = self._queue.get()
+            with self._changed:
+                job["status"] = "running"
+                job["started"] = time.time()
+                self._running += 1
+            try:
+                task = self._task(job)
+                record = self._pool.apply(engine.compare_pair, (task,))
+                record["baseline"], record["new"] = job["spec"]["baseline"]["label"], job["spec"]["new"]["label"]
+                self._record_changes(job["spec"]["baseline"], record)
+            except Exception as e:
+                record = {"name": job["spec"].get("name"), "diff_percent": None, "status": "error",
+                          "regions": [], "error": str(e)}
+            finally:
+                self._discard(job["spec"])
+            with self._changed:
+                job["record"] = record
+                job["status"] = "error" if record["status"] == "error" else "done"
+                job["finished"] = time.time()
+                self._running -= 1
+                while len(self._jobs) > KEEP_JOBS and next(iter(self._jobs.values()))["finished"]:
+                    self._jobs.popitem(last=False)
+                self._changed.notify_all()
+            self.metrics.record(job)
+
+    def _record_changes(self, baseline, record):
+        # Runs against stored baselines feed the same change maps as the app
+        if baseline["kind"] != "id" or record["status"] == "error":
+            return
+        try:
+            self.store.record_changes(baseline["key"], baseline["size"], record["regions"], record["diff_percent"])
+        except Exception as e:
+            record.setdefault("warnings", []).append(f"change map not updated: {e}")
+
+    def _task(self, job):
+        spec = job["spec"]
+        task = {key: value for key, value in spec.items() if key in OPTIONS and key not in ("width", "height", "full_page")}
+        task["name"] = spec.get("name") or job["id"]
+        task["baseline"] = self._resolve(job, "baseline")
+        task["new"] = self._resolve(job, "new")
+        if "ignore" in spec or "include" in spec:
+            task["ignore"], task["include"] = spec.get("ignore"), spec.get("include")
+        elif spec["baseline"]["kind"] == "id":
+            # Stored baselines bring the masks saved for them in the app
+            task.update(self.store.masks(spec["baseline"]["key"]))
+        return task
+
+    def _resolve(self, job, side):
+        # A path the worker process can decode
+        source = job["spec"][side]
+        if source["kind"] == "url":
+            record = self._capture(source["value"], job["spec"])
+            if record["error"]:
+                raise RuntimeError(f"capture of {source['value']} failed: {record['error']}")
+            path = os.path.join(self.spool, f"{job['id']}_{side}.png")
+            with open(path, "wb") as f:
+                f.write(record["png"])
+            source["path"] = path
+        return source["path"]
+
+    def _capture(self, url, spec):
+        # Captures share one browser in this process; Playwright is only loaded by the first URL job
+        with self._capture_lock:
+            if self._capture_pool is None:
+                import capture
+                self._capture_pool = capture.BackgroundBrowserPool(size=max(1, self.workers))
+        return self._capture_pool.capture(url, spec.get("width", 1280), spec.get("height", 720), spec.get("full_page", False))
+
+    def _discard(self, spec):
+        for side in ("baseline", "new"):
+            source = spec.get(side) or {}
+            if source.get("kind") in ("image", "url") and source.get("path"):
+                try:
+                    os.remove(source["path"])
+                except OSError:
+                    pass
+
+# ========== Job Specs ==========
+def parse_job(fields, body, spool, store):
+    # fields: options plus, for each side, one of <side>_image (base64), <side>_id (an
+    # approved baseline's id, baseline side only) or <side>_url. A raw request body is
+    # the new image.
+    spec = {}
+    for key, kind in OPTIONS.items():
+        if key in fields and fields[key] is not None:
+            spec[key] = _convert(key, fields[key], kind)
+    for key in ("ignore", "include"):
+        if key in fields:
+            spec[key] = fields[key]
+    if spec.get("metric", "pixel") not in ("pixel", "ssim"):
+        raise JobError("metric must be 'pixel' or 'ssim'")
+    paths = []
+    try:
+        for side in ("baseline", "new"):
+            given = [kind for kind in SOURCES if fields.get(f"{side}_{kind}") is not None]
+            if side == "new" and body is not None:
+                given.append("body")
+            if len(given) != 1:
+                choices = f"{side}_image, {side}_id or {side}_url" if side == "baseline" else "new_image, new_url or a request body"
+                raise JobError(f"give exactly one of {choices}")
+            kind, value = given[0], fields.get(f"{side}_{given[0]}")
+            if kind in ("image", "body"):
+                data = body if kind == "body" else _b64decode(side, value)
+                path = os.path.join(spool, f"{uuid.uuid4().hex}_{side}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                paths.append(path)
+                spec[side] = {"kind": "image", "path": path, "label": "upload"}
+            elif kind == "id":
+                if side != "baseline":
+                    raise JobError("only the baseline can be given by id")
+                try:
+                    entry = next(iter(store.baselines([_convert(f"{side}_id", value, int)])), None)
+                except OverflowError:
+                    # SQLite integers are 64-bit, so larger ids can't exist
+                    entry = None
+                if entry is None:
+                    raise JobError(f"no approved baseline with id {value}")
+                spec[side] = {"kind": "id", "key": baseline_key(store, entry["image"]), "path": store.image_path(entry["image"]),
+                              "size": (entry["width"], entry["height"]),
+                              "label": f"baseline:{entry['id']}"}
+            else:
+                spec[side] = {"kind": "url", "value": str(value), "label": str(value)}
+    except Exception:
+        for path in paths:
+            os.remove(path)
+        raise
+    return spec
+
+@lru_cache(maxsize=1024)
+def baseline_key(store, image):
+    # Masks and change maps are keyed by pixel content (cache.image_key), the same key
+    # the app gives uploads, captures and history images, not by the store's object
+    # hash, so each stored baseline is decoded once to find its key
+    return cache.image_key(store.image(image))
+
+def _convert(key, value, kind):
+    if isinstance(value, list):
+        value = value[-1]
+    try:
+        if kind is bool and isinstance(value, str):
+            return value.lower() in ("1", "true", "yes", "on")
+        return kind(value)
+    except (TypeError, ValueError):
+        raise JobError(f"{key} must be {kind.__name__}")
+
+def _b64decode(side, value):
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        raise JobError(f"{side}_image must be base64")
+
+# ========== HTTP Interface ==========
+class Handler(BaseHTTPRequestHandler):
+    # POST /jobs                 submit (JSON fields, or the new image as the body with
+    #                            fields in the query string); ?wait=S waits for a queue slot
+    # GET  /jobs/<id>?wait=S     job state, long-polling up to S seconds
+    # GET  /results?jobs=a,b     NDJSON stream of jobs as they finish (all jobs if none given)
+    # GET  /metrics, /health
+    protocol_version = "HTTP/1.1"
+    jobs = None
+    store = None
+
+    def do_POST(self):
+        path, params = self._route()
+        if path != "/jobs":
+            return self._send(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return self._send(400, {"error": "invalid Content-Length"})
+        if length > MAX_BODY_MB * 1024 * 1024:
+            return self._send(413, {"error": f"request body over {MAX_BODY_MB} MB"})
+        body = self.rfile.read(length) if length else None
+        fields = {key: values[-1] for key, values in params.items()}
+        if (self.headers.get("Content-Type") or "").startswith("application/json"):
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                return self._send(400, {"error": "invalid JSON"})
+            if not isinstance(payload, dict):
+                return self._send(400, {"error": "JSON body must be an object"})
+            fields.update(payload)
+            body = None
+        try:
+            wait = _convert("wait", fields.get("wait") or 0, float)
+            spec = parse_job(fields, body, self.jobs.spool, self.store)
+            job = self.jobs.submit(spec, wait)
+        except JobError as e:
+            return self._send(400, {"error": str(e)})
+        except QueueFull as e:
+            return self._send(429, {"error": str(e)}, {"Retry-After": "1"})
+        except Exception as e:
+            # Anything else is a bug, but the client still gets an answer
+            self.log_error("job submission failed: %r", e)
+            return self._send(500, {"error": f"internal error: {e}"})
+        self._send(202, job, {"Location": f"/jobs/{job['id']}"})
+
+    def do_GET(self):
+        path, params = self._route()
+        try:
+            wait = _convert("wait", params.get("wait", ["0"]), float)
+        except JobError as e:
+            return self._send(400, {"error": str(e)})
+        if path.startswith("/jobs/"):
+            job = self.jobs.get(path[len("/jobs/"):], wait)
+            return self._send(200, job) if job else self._send(404, {"error": "unknown job"})
+        if path == "/results":
+            ids = [i for i in params.get("jobs", [""])[-1].split(",") if i]
+            return self._stream(self.jobs.follow(ids or None, wait or None))
+        if path == "/metrics":
+            return self._send(200, self.jobs.stats())
+        if path == "/health":
+            return self._send(200, {"status": "ok"})
+        self._send(404, {"error": "not found"})
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        return parts.path.rstrip("/") or "/", parse_qs(parts.query)
+
+    def _send(self, status, payload, headers=None):
+        data = (json.dumps(payload) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, jobs):
+        # Chunked NDJSON, one line per finished job, flushed as each one lands
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for job in jobs:
+                line = (json.dumps(job) + "\n").encode()
+                self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(host="127.0.0.1", port=8765, workers=None, max_queue=MAX_QUEUE, store=None):
+    store = store or HistoryStore()
+    jobs = JobQueue(workers, max_queue, store)
+    handler = type("BoundHandler", (Handler,), {"jobs": jobs, "store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, jobs
+
+# ========== Entry Point ==========
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve comparisons over HTTP from a bounded job queue and a worker pool.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="Jobs that may wait before submissions get 429")
+    parser.add_argument("--store", default=None, help="History directory holding approved baselines (default: $VRA_HISTORY_DIR or ~/.cache/...)")
+    args = parser.parse_args(argv)
+
+    server, jobs = make_server(args.host, args.port, args.workers, args.max_queue,
+                               HistoryStore(args.store) if args.store else None)
+    print(json.dumps({"url": f"http://{args.host}:{server.server_address[1]}/", "workers": jobs.workers,
+                      "max_queue": args.max_queue}), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        jobs.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+
+# Stabilizing constants of Wang et al. for 8-bit images
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+_VALUES = np.arange(256, dtype=np.float32)
+_SQUARES = _VALUES ** 2
+
+# ========== Block Statistics ==========
+def block_means(values, block, out):
+    # Mean of every block x block cell (smaller at the right and bottom edges) into out.
+    # INTER_AREA at an integer factor is an exact box filter, so each edge strip gets
+    # its own resize instead of padding the image.
+    height, width = values.shape
+    h0, w0 = height // block * block, width // block * block
+    rows, cols = h0 // block, w0 // block
+    if rows and cols:
+        out[:rows, :cols] = cv2.resize(values[:h0, :w0], (cols, rows), interpolation=cv2.INTER_AREA)
+    if w0 < width and rows:
+        out[:rows, cols] = cv2.resize(values[:h0, w0:], (1, rows), interpolation=cv2.INTER_AREA).ravel()
+    if h0 < height and cols:
+        out[rows, :cols] = cv2.resize(values[h0:, :w0], (cols, 1), interpolation=cv2.INTER_AREA).ravel()
+    if h0 < height and w0 < width:
+        out[rows, cols] = values[h0:, w0:].mean()
+
+def grid_shape(height, width, block):
+    return -(-height // block), -(-width // block)
+
+# ========== Block SSIM ==========
+# SSIM per block from five block means: E[a], E[b], E[a²], E[b²] and E[(a-b)²], which
+# gives the covariance as (E[a²] + E[b²] - E[(a-b)²]) / 2 - E[a]E[b] without a float
+# product image. Squares come from a 256-entry lookup table. Strips of identical rows
+# are skipped (their SSIM is exactly 1), and the rest are processed a few block rows
+# at a time so the float planes stay in cache.
+def block_ssim(gray_a, gray_b, block=16, strip_rows=64):
+    height, width = gray_a.shape
+    rows, cols = grid_shape(height, width, block)
+    scores = np.ones((rows, cols), dtype=np.float32)
+    strip = max(block, strip_rows // block * block)
+    means = np.empty((5, -(-strip // block), cols), dtype=np.float32)
+    for y0 in range(0, height, strip):
+        a, b = gray_a[y0:y0 + strip], gray_b[y0:y0 + strip]
+        if np.array_equal(a, b):
+            continue
+        count = -(-a.shape[0] // block)
+        planes = (cv2.LUT(a, _VALUES), cv2.LUT(b, _VALUES), cv2.LUT(a, _SQUARES), cv2.LUT(b, _SQUARES),
+                  cv2.LUT(cv2.absdiff(a, b), _SQUARES))
+        for plane, out in zip(planes, means):
+            block_means(plane, block, out)
+        i = y0 // block
+        scores[i:i + count] = ssim_from_means(*means[:, :count].astype(np.float64))
+    return scores
+
+def ssim_from_means(mean_a, mean_b, mean_aa, mean_bb, mean_dd):
+    var_a = mean_aa - mean_a * mean_a
+    var_b = mean_bb - mean_b * mean_b
+    cov = (mean_aa + mean_bb - mean_dd) / 2 - mean_a * mean_b
+    return ((2 * mean_a * mean_b + C1) * (2 * cov + C2)) / ((mean_a * mean_a + mean_b * mean_b + C1) * (var_a + var_b + C2))
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import align
+import engine
+
+def check_opcodes(a, b, opcodes):
+    # difflib-style opcodes: contiguous over both sequences, equal runs really equal,
+    # replaced rows really different, and no two neighbours that should have merged
+    a0 = b0 = 0
+    previous = None
+    for tag, i0, i1, j0, j1 in opcodes:
+        assert (i0, j0) == (a0, b0) and i0 <= i1 and j0 <= j1 and (i0 < i1 or j0 < j1)
+        if tag in ("equal", "replace"):
+            assert i1 - i0 == j1 - j0
+            same = np.asarray(a[i0:i1]) == np.asarray(b[j0:j1])
+            assert same.all() if tag == "equal" else not same.any()
+        elif tag == "insert":
+            assert i0 == i1
+        else:
+            assert tag == "delete" and j0 == j1
+        assert tag != previous
+        previous, a0, b0 = tag, i1, j1
+    assert (a0, b0) == (len(a), len(b))
+
+@pytest.mark.parametrize("seed", range(40))
+def test_opcodes_are_valid_for_random_edits(seed):
+    rng = np.random.default_rng(seed)
+    # A small alphabet repeats rows, so many gaps have no unique anchors and fall back to _shift
+    a = rng.integers(0, 4 if seed % 2 else 1000, int(rng.integers(0, 80)), dtype=np.uint64)
+    b = a.copy()
+    for _ in range(int(rng.integers(0, 4))):
+        at = int(rng.integers(0, len(b) + 1))
+        if rng.random() < 0.5:
+            b = np.concatenate([b[:at], rng.integers(0, 1000, int(rng.integers(1, 10)), dtype=np.uint64), b[at:]])
+        else:
+            b = np.concatenate([b[:at], b[at + int(rng.integers(1, 10)):]])
+    check_opcodes(a, b, align.align_rows(a, b))
+
+def test_unique_rows_anchor_an_inserted_band():
+    a = np.arange(100, dtype=np.uint64)
+    b = np.concatenate([a[:30], np.arange(1000, 1012, dtype=np.uint64), a[30:]])
+    assert align.align_rows(a, b) == [("equal", 0, 30, 0, 30), ("insert", 30, 30, 30, 42), ("equal", 30, 100, 42, 112)]
+    assert align.align_rows(b, a) == [("equal", 0, 30, 0, 30), ("delete", 30, 42, 30, 30), ("equal", 42, 112, 30, 100)]
+
+def test_repeated_rows_fall_back_to_the_best_single_shift():
+    # A flat page with a band of identical rows has nothing unique to anchor on
+    a = np.zeros(100, dtype=np.uint64)
+    b = np.concatenate([a[:40], np.ones(10, dtype=np.uint64), a[40:]])
+    assert align.align_rows(a, b) == [("equal", 0, 40, 0, 40), ("insert", 40, 40, 40, 50), ("equal", 40, 100, 50, 110)]
+    assert align.align_rows(b, a) == [("equal", 0, 40, 0, 40), ("delete", 40, 50, 40, 40), ("equal", 50, 110, 40, 100)]
+    c = b.copy()
+    c[70] = 2
+    check_opcodes(a, c, align.align_rows(a, c))
+
+def test_identical_and_empty_sequences():
+    a = np.arange(5, dtype=np.uint64)
+    assert align.align_rows(a, a) == [("equal", 0, 5, 0, 5)]
+    assert align.align_rows(a[:0], a) == [("insert", 0, 0, 0, 5)]
+    assert align.align_rows(a, a[:0]) == [("delete", 0, 5, 0, 0)]
+    assert align.align_rows(a[:0], a[:0]) == []
+
+def test_inserted_band_is_reported_instead_of_a_diff():
+    rng = np.random.default_rng(3)
+    baseline = rng.integers(0, 256, (120, 64, 3), dtype=np.uint8)
+    band = rng.integers(0, 256, (20, 64, 3), dtype=np.uint8)
+    new = np.concatenate([baseline[:50], band, baseline[50:]])
+    result = engine.compare_images(baseline, new, 50, draw=False)
+    assert result['bands'] == [{'type': 'inserted', 'new_rows': (50, 70), 'baseline_row': 50}]
+    assert result['regions'] == []
+    # Inserted rows count as changed and as checked
+    assert result['diff_percent'] == round(20 / 140 * 100, 2)
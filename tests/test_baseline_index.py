@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import baseline_index
+from baseline_index import BaselineIndex, _to_signed
+
+class MemoryStore:
+    # Just the baselines table of a HistoryStore, so thousands of hashes load instantly
+    def __init__(self, hashes=()):
+        self.rows = []
+        self.add(hashes)
+
+    def add(self, hashes):
+        for value in hashes:
+            self.rows.append((len(self.rows) + 1, _to_signed(int(value))))
+
+    def baseline_hashes(self, after_id=0):
+        return [row for row in self.rows if row[0] > after_id]
+
+    def baselines(self, ids):
+        return [{"id": i, "dhash": self.rows[i - 1][1], "name": None} for i in ids]
+
+def random_hashes(rng, count):
+    return rng.integers(0, 2 ** 64, count, dtype=np.uint64)
+
+def flip(value, rng, bits):
+    for bit in rng.choice(64, bits, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+def brute_force(store, query, k, max_distance):
+    matches = [(bin((h % 2 ** 64) ^ query).count("1"), i) for i, h in store.rows]
+    return [(i, d) for d, i in sorted(matches) if d <= max_distance][:k]
+
+@pytest.fixture
+def small_thresholds(monkeypatch):
+    # With NumPy 2 the index scans up to a million hashes, so force the probe path
+    monkeypatch.setattr(baseline_index, "SCAN_BELOW", 64)
+    monkeypatch.setattr(baseline_index, "TAIL_SIZE", 32)
+
+@pytest.mark.parametrize("max_distance", [0, 3, 7, 10, 15])
+def test_probe_matches_brute_force(small_thresholds, max_distance):
+    rng = np.random.default_rng(max_distance)
+    hashes = random_hashes(rng, 3000)
+    # Near-duplicates, so queries have several matches at a spread of distances
+    hashes[2000:] = [flip(int(hashes[i % 50]), rng, int(rng.integers(0, 16))) for i in range(1000)]
+    store = MemoryStore(hashes)
+    index = BaselineIndex(store)
+    assert index.indexed == len(index) and index.tables
+    for i in range(60):
+        query = flip(int(hashes[int(rng.integers(0, 3000))]), rng, int(rng.integers(0, 12)))
+        found = [(entry["id"], entry["distance"]) for entry in index.nearest(query, 8, max_distance)]
+        assert found == brute_force(store, query, 8, max_distance)
+
+def test_tail_is_searched_and_folded_into_the_tables(small_thresholds):
+    rng = np.random.default_rng(7)
+    store = MemoryStore(random_hashes(rng, 1000))
+    index = BaselineIndex(store)
+    assert index.indexed == 1000
+
+    # Up to an eighth of the index waits in the unsorted tail, and is still found
+    tail = random_hashes(rng, 125)
+    store.add(tail)
+    for value in tail[::25]:
+        query = flip(int(value), rng, 4)
+        assert [(e["id"], e["distance"]) for e in index.nearest(query, 3)] == brute_force(store, query, 3, 10)
+    assert len(index) == 1125 and index.indexed == 1000
+
+    # One more and the tail is folded in
+    store.add(random_hashes(rng, 1))
+    index.refresh()
+    assert index.indexed == len(index) == 1126
+    query = flip(int(tail[0]), rng, 5)
+    assert [(e["id"], e["distance"]) for e in index.nearest(query, 3)] == brute_force(store, query, 3, 10)
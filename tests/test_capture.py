@@ -0,0 +1,82 @@
+import asyncio
+
+import capture
+
+class FakePage:
+    def __init__(self, log, delay):
+        self.log, self.delay = log, delay
+
+    async def set_viewport_size(self, size):
+        pass
+
+    async def goto(self, url, wait_until, timeout):
+        self.log.append(("goto", timeout))
+        await asyncio.sleep(self.delay)
+
+    async def wait_for_load_state(self, state, timeout):
+        self.log.append(("settle", timeout))
+        await asyncio.sleep(self.delay)
+
+    async def screenshot(self, full_page, timeout):
+        self.log.append(("screenshot", timeout))
+        return b"png"
+
+    async def close(self):
+        pass
+
+class FakeContext:
+    def __init__(self, browser):
+        self.browser, self.closed = browser, False
+
+    async def new_page(self):
+        return FakePage(self.browser.log, self.browser.delay)
+
+    async def close(self):
+        self.closed = True
+
+class FakeBrowser:
+    def __init__(self, delay=0.0):
+        self.log, self.delay, self.contexts = [], delay, []
+
+    async def new_context(self):
+        self.contexts.append(FakeContext(self))
+        return self.contexts[-1]
+
+async def make_pool(browser, size=1, timeout=30.0):
+    # A BrowserPool as start() would leave it, minus Playwright
+    pool = capture.BrowserPool(size, timeout)
+    pool._browser = browser
+    pool._contexts = asyncio.Queue()
+    for _ in range(size):
+        pool._contexts.put_nowait(await browser.new_context())
+    return pool
+
+def test_every_capture_gets_a_fresh_context():
+    browser = FakeBrowser()
+    async def run():
+        pool = await make_pool(browser)
+        records = [await pool.capture("http://a"), await pool.capture("http://b")]
+        return records, pool._contexts.qsize()
+    records, free = asyncio.run(run())
+    assert [record["png"] for record in records] == [b"png", b"png"]
+    # Each used context is closed and replaced, and the pool keeps its size
+    assert [context.closed for context in browser.contexts] == [True, True, False] and free == 1
+
+def test_steps_share_one_deadline():
+    browser = FakeBrowser(delay=0.2)
+    async def run():
+        pool = await make_pool(browser, timeout=1.0)
+        return await pool.capture("http://slow")
+    record = asyncio.run(run())
+    (_, goto), (_, settle), (_, shot) = browser.log
+    assert record["error"] is None and goto <= 1000
+    assert settle <= goto - 190 and shot <= settle - 190
+
+def test_exhausted_deadline_fails_instead_of_waiting_forever():
+    browser = FakeBrowser(delay=0.3)
+    async def run():
+        pool = await make_pool(browser, timeout=0.5)
+        return await pool.capture("http://slow")
+    record = asyncio.run(run())
+    assert record["png"] is None and "timed out" in record["error"]
+    assert [step for step, _ in browser.log] == ["goto", "settle"]
@@ -0,0 +1,36 @@
+import zipfile
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+import cache
+import export
+
+def entry(name, seed):
+    image = Image.fromarray(np.random.default_rng(seed).integers(0, 256, (24, 32, 3), dtype=np.uint8))
+    return {"name": name, "summary": {"Difference %": seed},
+            "images": {"baseline": (cache.image_key(image), image), "highlighted": (None, lambda: image)}}
+
+def test_bundle_is_a_valid_download():
+    exporter = export.Exporter(cache.LRUCache())
+    data = exporter.bundle([entry("first", 1), entry("second", 2)]).result()
+    # The same conversion st.download_button applies to what a deferred data callable returns
+    converted, _ = convert_data_to_bytes_and_infer_mime(data, TypeError("unsupported download type"))
+    with zipfile.ZipFile(BytesIO(converted)) as archive:
+        names = archive.namelist()
+        index = archive.read("index.html").decode()
+        image = Image.open(BytesIO(archive.read("assets/0002_highlighted.png")))
+    assert names == ["assets/0001_baseline.png", "assets/0001_highlighted.png",
+                     "assets/0002_baseline.png", "assets/0002_highlighted.png", "index.html"]
+    assert "first" in index and "second" in index and image.size == (32, 24)
+
+def test_encoded_downloads_are_cached_per_format():
+    memo = cache.LRUCache()
+    exporter = export.Exporter(memo)
+    image = entry("only", 3)["images"]["baseline"][1]
+    png = exporter.encoded("k", image)
+    webp = exporter.encoded("k", lambda: image, "webp")
+    assert Image.open(BytesIO(png)).format == "PNG" and Image.open(BytesIO(webp)).format == "WEBP"
+    assert exporter.encoded("k", None) == png
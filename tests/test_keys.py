@@ -0,0 +1,31 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import cache
+import history_store
+import service
+
+def _image(seed=0, size=(48, 64)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (*size, 3), dtype=np.uint8))
+
+def _png(image, level=6):
+    buf = BytesIO()
+    image.save(buf, format="PNG", compress_level=level)
+    return buf.getvalue()
+
+def test_key_follows_pixels_not_file_bytes():
+    image = _image()
+    memo = cache.LRUCache()
+    _, fast = cache.decode_image(memo, _png(image, 1))
+    _, small = cache.decode_image(memo, _png(image, 9))
+    assert fast == small == cache.image_key(image) == cache.image_key(np.asarray(image))
+    assert cache.image_key(image.convert("RGBA")) == fast
+    assert cache.image_key(_image(1)) != fast
+
+def test_service_baseline_key_matches_app_upload(tmp_path):
+    store = history_store.HistoryStore(str(tmp_path))
+    image, key = cache.decode_image(cache.LRUCache(), _png(_image()))
+    assert service.baseline_key(store, store.put_image(image)) == key
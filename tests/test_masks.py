@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import engine
+
+def pair(seed=0, height=400, width=240):
+    rng = np.random.default_rng(seed)
+    baseline = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    new = baseline.copy()
+    for _ in range(30):
+        y, x = rng.integers(0, (height, width))
+        h, w = rng.integers(1, 30, 2)
+        new[y:y + h, x:x + w] = baseline[y:y + h, x:x + w] + 150
+    return baseline, new
+
+def masked_reference(baseline, new, tolerance, ignore=(), include=()):
+    # The changes outside the checked area are undone, so a plain comparison of the
+    # whole image has to find the same regions
+    checked = np.zeros(baseline.shape[:2], dtype=bool)
+    for y0, y1, x0, x1 in engine.checked_rects(baseline.shape[1], baseline.shape[0], ignore, include):
+        checked[y0:y1, x0:x1] = True
+    new = np.where(checked[..., None], new, baseline)
+    return engine.compare_images(baseline, new, tolerance, draw=False, align=False)['regions']
+
+@pytest.mark.parametrize("masks", [
+    {"include": [[100, 150, 50, 50]]},
+    {"include": [[0, 0, 60, 60], [200, 350, 40, 50]]},
+    {"ignore": [[0, 0, 240, 200]]},
+    {"ignore": [[50, 50, 100, 100]], "include": [[0, 0, 240, 300]]},
+])
+def test_masked_regions_stay_inside_the_checked_area(masks):
+    baseline, new = pair()
+    result = engine.compare_images(baseline, new, 50, draw=False, **masks)
+    assert result['regions'] == masked_reference(baseline, new, 50, **masks)
+    # Moving the tolerance later scans only the same window
+    for tolerance in (0, 50, 200):
+        assert (engine.regions_at(result['gray_diff'], tolerance, result['window'])
+                == engine.regions_at(result['gray_diff'], tolerance))
+
+def test_roi_only_check_scans_just_the_roi():
+    baseline, new = pair(1)
+    result = engine.compare_images(baseline, new, 50, draw=False, include=[[100, 150, 50, 50]])
+    assert result['window'] == (150, 200, 100, 150)
+    coarse = engine.compare_images_coarse_to_fine(baseline, new, 50, draw=False, tile=64, min_tile=8,
+                                                  include=[[100, 150, 50, 50]])
+    assert coarse['regions'] == result['regions'] and coarse['diff_percent'] == result['diff_percent']
+
+def test_deleted_rows_inside_an_roi_are_one_region():
+    rng = np.random.default_rng(2)
+    baseline = rng.integers(0, 256, (200, 80, 3), dtype=np.uint8)
+    new = np.concatenate([baseline[:90], baseline[110:]])
+    result = engine.compare_images(baseline, new, 50, draw=False, include=[[10, 50, 30, 100]])
+    assert result['bands'][0]['type'] == 'deleted'
+    assert [(r['x'], r['y'], r['w'], r['h']) for r in result['regions']] == [(10, 90, 30, 20)]
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+
+import engine
+
+def changed_page(seed, height=300, width=200, blobs=40):
+    rng = np.random.default_rng(seed)
+    baseline = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    new = baseline.copy()
+    for _ in range(blobs):
+        y, x = rng.integers(0, (height, width))
+        h, w = rng.integers(1, 25, 2)
+        new[y:y + h, x:x + w] = baseline[y:y + h, x:x + w] + rng.integers(0, 180, dtype=np.uint8)
+    return baseline, new
+
+def whole_mask_regions(thresh, gray_diff):
+    # Reference: label the whole grouped mask at once instead of one row run at a time
+    if not cv2.countNonZero(thresh):
+        return []
+    grouped, r = engine.group_mask(thresh)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(grouped, connectivity=8)
+    areas, totals = engine._label_sums(labels[r:-r, r:-r], thresh, gray_diff, count)
+    return engine.finish_regions(stats[1:, :4], areas[1:], totals[1:], r)
+
+@pytest.mark.parametrize("seed", range(12))
+def test_row_runs_match_labelling_the_whole_mask(seed):
+    baseline, new = changed_page(seed, blobs=5 + 10 * seed)
+    gray_diff = cv2.cvtColor(cv2.absdiff(baseline, new), cv2.COLOR_RGB2GRAY)
+    _, thresh = cv2.threshold(gray_diff, 50, 255, cv2.THRESH_BINARY)
+    assert engine.extract_regions(thresh, gray_diff) == whole_mask_regions(thresh, gray_diff)
+
+def test_regions_are_tight_boxes_of_the_changed_pixels():
+    thresh = np.zeros((50, 80), dtype=np.uint8)
+    thresh[0:3, 0:4] = 255
+    thresh[5:9, 6:8] = 255
+    thresh[30:40, 70:80] = 255
+    gray_diff = thresh // 5
+    regions = engine.extract_regions(thresh, gray_diff)
+    # The first two are within MERGE_DISTANCE of each other, and boxes at the edges aren't clipped
+    assert regions == [{'x': 0, 'y': 0, 'w': 8, 'h': 9, 'area': 20, 'mean_intensity': 51.0},
+                       {'x': 70, 'y': 30, 'w': 10, 'h': 10, 'area': 100, 'mean_intensity': 51.0}]
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("tolerance", [0, 50, 120])
+def test_modes_agree_on_regions(seed, tolerance):
+    baseline, new = changed_page(seed)
+    normal = engine.compare_images(baseline, new, tolerance, draw=False, align=False)
+    coarse = engine.compare_images_coarse_to_fine(baseline, new, tolerance, draw=False, tile=64, min_tile=8, align=False)
+    tiled = engine.compare_images_tiled(baseline, new, tolerance, draw=False, band_rows=23)
+    assert normal['regions']
+    for result in (coarse, tiled):
+        assert result['regions'] == normal['regions']
+        assert result['diff_percent'] == normal['diff_percent']
+    # And after moving the tolerance of an existing result
+    assert engine.regions_at(normal['gray_diff'], tolerance) == normal['regions']
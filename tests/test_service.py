@@ -0,0 +1,139 @@
+import base64
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import history_store
+import service
+
+def start(tmp_path, **options):
+    server, jobs = service.make_server(port=0, workers=1, store=history_store.HistoryStore(str(tmp_path)), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, jobs, f"http://127.0.0.1:{server.server_address[1]}"
+
+def stop(server, jobs):
+    server.shutdown()
+    server.server_close()
+    jobs.close()
+
+@pytest.fixture
+def server(tmp_path):
+    server, jobs, base = start(tmp_path)
+    yield base
+    stop(server, jobs)
+
+@pytest.fixture
+def gated(tmp_path, monkeypatch):
+    # One worker and one queue slot; the dispatcher holds each job until the gate opens,
+    # so the queue fills up deterministically
+    gate = threading.Event()
+    task = service.JobQueue._task
+    def held(self, job):
+        gate.wait(30)
+        return task(self, job)
+    monkeypatch.setattr(service.JobQueue, "_task", held)
+    server, jobs, base = start(tmp_path, max_queue=1)
+    yield base, jobs, gate
+    gate.set()
+    stop(server, jobs)
+
+def request(base, path, payload=None, timeout=30):
+    data = None if payload is None else json.dumps(payload).encode()
+    req = urllib.request.Request(base + path, data=data, method="GET" if data is None else "POST",
+                                 headers={"Content-Type": "application/json"} if data else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def post(base, payload, path="/jobs"):
+    status, _, body = request(base, path, payload)
+    return status, json.loads(body)
+
+def png(seed, changed=False):
+    array = np.random.default_rng(seed).integers(0, 100, (40, 60, 3), dtype=np.uint8)
+    if changed:
+        array[10:20, 10:30] = 255 - array[10:20, 10:30]
+    buf = BytesIO()
+    Image.fromarray(array).save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+def job(name):
+    return {"name": name, "baseline_image": png(0), "new_image": png(0, changed=True)}
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+@pytest.mark.parametrize("payload", [[1, 2], [["baseline_id", 1]], "text", 3])
+def test_non_object_json_is_rejected(server, payload):
+    status, reply = post(server, payload)
+    assert status == 400 and "object" in reply["error"]
+
+def test_out_of_range_baseline_id_is_a_bad_request(server):
+    status, reply = post(server, {"baseline_id": 10 ** 30, "new_url": "https://example.com"})
+    assert status == 400 and "no approved baseline" in reply["error"]
+
+def test_unexpected_errors_still_get_a_response(server, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(service, "parse_job", broken)
+    status, reply = post(server, {})
+    assert status == 500 and "boom" in reply["error"]
+
+def test_job_runs_to_done_through_long_polling(server):
+    status, reply = post(server, job("one"))
+    assert status == 202 and reply["status"] in ("queued", "running")
+    status, _, body = request(server, f"/jobs/{reply['id']}?wait=30")
+    state = json.loads(body)
+    assert status == 200 and state["status"] == "done" and state["finished"] >= state["started"]
+    record = state["record"]
+    assert record["name"] == "one" and record["diff_percent"] == round(200 / 2400 * 100, 2)
+    assert [(r["x"], r["y"], r["w"], r["h"]) for r in record["regions"]] == [(10, 10, 20, 10)]
+    assert request(server, "/jobs/unknown")[0] == 404
+
+def test_full_queue_is_rejected_then_drains(gated):
+    base, jobs, gate = gated
+    first = post(base, job("first"))
+    # The dispatcher has taken the first job, so the second one fills the only slot
+    wait_for(lambda: jobs.stats()["running"] == 1)
+    second = post(base, job("second"))
+    status, headers, body = request(base, "/jobs", job("third"))
+    assert (first[0], second[0], status) == (202, 202, 429)
+    assert headers["Retry-After"] == "1" and "queue is full" in json.loads(body)["error"]
+
+    # wait= holds the request until a slot frees up instead of answering 429
+    waited = {}
+    thread = threading.Thread(target=lambda: waited.update(reply=post(base, job("fourth"), "/jobs?wait=30")))
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    gate.set()
+    thread.join(30)
+    status, fourth = waited["reply"]
+    assert status == 202
+
+    ids = [first[1]["id"], second[1]["id"], fourth["id"]]
+    status, headers, body = request(base, "/results?jobs=" + ",".join(ids))
+    streamed = [json.loads(line) for line in body.splitlines()]
+    assert status == 200 and "ndjson" in headers["Content-Type"]
+    assert sorted(state["id"] for state in streamed) == sorted(ids)
+    assert [state["record"]["name"] for state in streamed] == ["first", "second", "fourth"]
+    assert all(state["status"] == "done" for state in streamed)
+
+    status, _, body = request(base, "/metrics")
+    metrics = json.loads(body)
+    assert {key: metrics[key] for key in ("submitted", "completed", "errors", "rejected")} == \
+        {"submitted": 3, "completed": 3, "errors": 0, "rejected": 1}
+    assert (metrics["queue_depth"], metrics["queue_capacity"], metrics["running"], metrics["workers"]) == (0, 1, 0, 1)
+    assert metrics["latency"]["total_ms"]["p50"] > 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import engine
+
+def page(seed=0, height=240, width=160):
+    # A dark noisy page and a copy with changes laid across the band seams of every
+    # band_rows below: blocks, a tall bar, a U whose arms only join far below, pixels
+    # touching diagonally across a row, specks under MIN_REGION_AREA and edits under
+    # the tolerance
+    rng = np.random.default_rng(seed)
+    baseline = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    new = baseline.copy()
+    def change(y0, y1, x0, x1, amount=150):
+        new[y0:y1, x0:x1] = baseline[y0:y1, x0:x1] + amount
+    change(5, 30, 10, 40)
+    change(60, 200, 70, 73)
+    change(100, 180, 110, 113)
+    change(100, 180, 140, 143)
+    change(178, 181, 110, 143)
+    change(40, 41, 120, 121)
+    change(41, 42, 121, 122)
+    change(215, 240, 0, 160)
+    for y, x in rng.integers(0, (height, width), (12, 2)):
+        change(y, y + 1, x, x + 1)
+    change(30, 90, 0, 60, amount=20)
+    return baseline, new
+
+def summary(result):
+    return result['diff_percent'], result['regions'], result['histogram'].tolist()
+
+@pytest.mark.parametrize("band_rows", [1, 3, 7, 16, 41, 100, 240, 1000])
+def test_tiled_matches_whole_image(band_rows):
+    baseline, new = page()
+    whole = engine.compare_images(baseline, new, 50, align=False)
+    tiled = engine.compare_images_tiled(baseline, new, 50, band_rows=band_rows)
+    assert summary(tiled) == summary(whole)
+    assert tiled['band_count'] == -(-baseline.shape[0] // band_rows)
+    assert np.array_equal(np.asarray(tiled['highlighted']), np.asarray(whole['highlighted']))
+
+@pytest.mark.parametrize("tolerance", [0, 10, 100, 255])
+def test_tiled_matches_whole_image_at_any_tolerance(tolerance):
+    baseline, new = page(1)
+    whole = engine.compare_images(baseline, new, tolerance, draw=False, align=False)
+    tiled = engine.compare_images_tiled(baseline, new, tolerance, draw=False, band_rows=9)
+    assert summary(tiled) == summary(whole)
+
+def test_groups_joined_below_a_seam_are_one_region():
+    baseline, new = page()
+    regions = engine.compare_images_tiled(baseline, new, 50, draw=False, band_rows=5)['regions']
+    # The U's arms (x 110 and 140) are only connected by its base at row 178
+    u = [region for region in regions if region['y'] == 100]
+    assert [(region['x'], region['w'], region['h']) for region in u] == [(110, 33, 81)]
+
+def test_seam_links_follow_8_connectivity():
+    parent = {node: node for node in (1, 2, 3, 4)}
+    engine._link_seams(np.array([0, 1, 0, 0, 2, 0]), np.array([0, 0, 3, 0, 0, 0]), parent)
+    assert engine._find(parent, 3) == engine._find(parent, 1)
+    assert engine._find(parent, 2) == 2 and engine._find(parent, 4) == 4
+    merged = sorted(engine._merge_groups(parent, {1: (0, 0, 2, 3, 4, 40.0), 3: (1, 3, 4, 5, 2, 10.0),
+                                                  2: (5, 0, 6, 1, 1, 5.0)}))
+    assert merged == [(0, 0, 4, 5, 6, 50.0), (5, 0, 6, 1, 1, 5.0)]
+
+def test_early_exit_stops_at_the_fail_threshold():
+    baseline, new = page()
+    result = engine.compare_images_tiled(baseline, new, 50, draw=False, band_rows=16, fail_threshold=5)
+    assert result['early_exit'] and result['diff_percent'] >= 5
+    assert result['band_count'] < -(-baseline.shape[0] // 16)
@@ -0,0 +1,15 @@
+import sys
+
+import timing
+
+def test_lazy_import_records_only_the_first_load(monkeypatch):
+    monkeypatch.setitem(timing.STARTUP, "lazy_imports", {})
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    first = timing.lazy_import("colorsys")
+    assert "colorsys" not in timing.STARTUP["lazy_imports"]
+    assert first.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert timing.STARTUP["lazy_imports"]["colorsys"] >= 0
+    # A rerun of the app makes a new stand-in for the module that is loaded already
+    timing.STARTUP["lazy_imports"]["colorsys"] = 123.0
+    assert timing.lazy_import("colorsys").hsv_to_rgb(0, 1, 1) == (1, 0, 0)
+    assert timing.STARTUP["lazy_imports"] == {"colorsys": 123.0}
@@ -0,0 +1,121 @@
+import ctypes
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Pipeline stages in the order a UI run goes through them
+STAGES = (
+    "decode", "rgb", "resize", "align", "absdiff", "grayscale", "threshold", "histogram",
+    "ssim", "regions", "overlay", "png_encode", "history_save"
+)
+
+# ========== Stage Timer ==========
+class StageTimer:
+    # Accumulates wall time per named stage; repeated stages (tiles, bands) add up.
+    # on_stage(name) is called as each stage finishes, e.g. to drive a progress bar.
+    def __init__(self, on_stage=None):
+        self.stages = {}
+        self.on_stage = on_stage
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+            if self.on_stage:
+                self.on_stage(name)
+
+    def record(self):
+        stages = {name: round(ms, 2) for name, ms in self.stages.items()}
+        return {"stages": stages, "total_ms": round(sum(self.stages.values()), 2)}
+
+def stage_progress(name):
+    # Fraction of the pipeline done once `name` has finished
+    if name not in STAGES:
+        return None
+    return (STAGES.index(name) + 1) / len(STAGES)
+
+# ========== Memory ==========
+def status_kb(field):
+    # Linux only: VmHWM is the peak resident set of this process, VmRSS the current one
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+@contextmanager
+def peak_memory():
+    # Peak RSS growth over the block in MB, or None where the kernel's high-water mark
+    # can't be reset (non-Linux)
+    usage = {"peak_mb": None}
+    _release_free_memory()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = status_kb("VmRSS")
+    except OSError:
+        before = None
+    try:
+        yield usage
+    finally:
+        peak = status_kb("VmHWM")
+        if before is not None and peak is not None:
+            usage["peak_mb"] = round(max(0, peak - before) / 1024, 1)
+
+def _release_free_memory():
+    # glibc keeps freed blocks for reuse, which would hide the block's allocations from RSS
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# ========== Startup ==========
+# Process-wide startup figures: how long the app's own imports and its first render
+# took, and what each lazily imported module cost when a feature first needed it
+STARTUP = {"imports_ms": None, "first_render_ms": None, "lazy_imports": {}}
+
+class LazyModule:
+    # Stand-in for a heavy module (OpenCV, Playwright, the canvas component) that is
+    # imported on first attribute access, so sessions that never use it don't pay for it
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    # Every rerun of the script makes new stand-ins, so only the import
+                    # that actually loads the module is recorded
+                    loaded = self._name in sys.modules
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if not loaded:
+                        STARTUP["lazy_imports"][self._name] = round((time.perf_counter() - start) * 1000, 2)
+                    self._module = module
+        return getattr(self._module, attr)
+
+def lazy_import(name):
+    return LazyModule(name)
+
+def record_startup(key, start):
+    # Keeps the first measurement only; later reruns reuse the loaded modules
+    if STARTUP[key] is None:
+        STARTUP[key] = round((time.perf_counter() - start) * 1000, 2)
+        return True
+    return False
+
+def startup_report():
+    lazy = STARTUP["lazy_imports"]
+    rows = [{"Step": "App imports", "ms": STARTUP["imports_ms"]}, {"Step": "First render", "ms": STARTUP["first_render_ms"]}]
+    rows += [{"Step": f"import {name} (on first use)", "ms": ms} for name, ms in lazy.items()]
+    return rows